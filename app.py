@@ -2,6 +2,9 @@ import streamlit as st
 import pandas as pd
 from database_manager import DatabaseManager
 from llmbackend import ArgoRAG
+from rag_service import RAGService, PRIORITY_INTERACTIVE
+from metrics import start_metrics_server
+from config import RAG_METRICS_PORT
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -11,10 +14,17 @@ st.set_page_config(
 )
 
 # --- App State Management ---
+# One RAG service is shared by all sessions so concurrent questions are coalesced and Ollama is not overloaded
+@st.cache_resource
+def get_rag_service():
+    # The RAG pipeline runs in this process, so its stage timings are only scrapeable from here
+    if RAG_METRICS_PORT:
+        start_metrics_server(RAG_METRICS_PORT)
+    return RAGService(ArgoRAG(DatabaseManager()))
+
 # Using the session state to store the chatbot and conversation history
-if 'db_manager' not in st.session_state:
-    st.session_state.db_manager = DatabaseManager()
-    st.session_state.rag_chatbot = ArgoRAG(st.session_state.db_manager)
+if 'rag_service' not in st.session_state:
+    st.session_state.rag_service = get_rag_service()
     st.session_state.messages = []
 
 # --- UI Rendering ---
@@ -42,7 +52,7 @@ if prompt := st.chat_input("Show me salinity profiles near the equator in March
         message_placeholder.markdown("Thinking...")
         
         # Get response from the RAG pipeline
-        response, retrieved_data = st.session_state.rag_chatbot.answer_question(prompt)
+        response, retrieved_data = st.session_state.rag_service.ask(prompt, priority=PRIORITY_INTERACTIVE)
         
         message_placeholder.markdown(response)
         
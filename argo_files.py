@@ -0,0 +1,57 @@
+import os
+import re
+
+# ARGO profile file names: optional B (BGC), M (merged) or S (synthetic) prefix, R (real-time) or
+# D (delayed-mode), the WMO number, the cycle number and a trailing D for descending profiles,
+# e.g. R1902669_003.nc, D1902669_003D.nc or BD1902669_003.nc
+PROFILE_FILENAME = re.compile(r"^(?P<kind>[BMS]?)(?P<mode>[RD])(?P<wmo>\d{5,8})_(?P<cycle>\d+)(?P<descending>D?)\.nc$")
+
+# Higher ranks supersede lower ones for the same (wmo, cycle); unknown modes count as real-time
+DATA_MODE_RANK = {'R': 1, 'A': 2, 'D': 3}
+
+
+def data_mode_rank(mode):
+    return DATA_MODE_RANK.get((mode or 'R').strip().upper(), 1)
+
+
+def parse_profile_filename(path):
+    """
+    Returns a dict with kind, mode, wmo, cycle and descending for an ARGO profile file name, or None.
+    """
+    match = PROFILE_FILENAME.match(os.path.basename(path))
+    if not match:
+        return None
+    info = match.groupdict()
+    info['wmo'] = int(info['wmo'])
+    info['cycle'] = int(info['cycle'])
+    info['descending'] = bool(info['descending'])
+    return info
+
+
+def _preference(info):
+    # The database holds one profile per cycle, so an ascending profile beats a descending one,
+    # then delayed-mode beats real-time
+    return (not info['descending'], data_mode_rank(info['mode']))
+
+
+def resolve_preferred_files(paths):
+    """
+    Keeps one file per (kind, wmo, cycle), preferring ascending over descending profiles and
+    delayed-mode D files over real-time R files.
+    Returns (kept_paths, superseded_paths); names that do not follow the ARGO convention are always kept.
+    """
+    best = {}
+    kept = []
+    for path in paths:
+        info = parse_profile_filename(path)
+        if info is None:
+            kept.append(path)
+            continue
+        key = (info['kind'], info['wmo'], info['cycle'])
+        current = best.get(key)
+        if current is None or _preference(info) > _preference(parse_profile_filename(current)):
+            best[key] = path
+    kept.extend(best.values())
+    kept_set = set(kept)
+    superseded = [p for p in paths if p not in kept_set]
+    return sorted(kept), superseded
@@ -0,0 +1,399 @@
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import netCDF4
+from sqlalchemy import create_engine
+
+
+# --- Synthetic ARGO data ---
+
+def generate_synthetic_argo_files(out_dir, n_files, profiles_per_file, n_levels, bgc=False, seed=0):
+    """
+    Writes ARGO-format profile files (D<wmo>_<cycle>.nc) with realistic-looking T/S structure.
+    Profiles in a multi-profile file get consecutive cycle numbers, so none of them is skipped as a duplicate.
+    Returns the list of written paths.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for n in range(n_files):
+        wmo = 5900000 + n // 50
+        cycle = (n % 50) * profiles_per_file + 1
+        path = os.path.join(out_dir, f"D{wmo}_{cycle:03d}.nc")
+        with netCDF4.Dataset(path, 'w', format='NETCDF4_CLASSIC') as ds:
+            ds.project_name = 'SYNTHETIC BENCHMARK'
+            ds.platform_type = 'APEX'
+            ds.createDimension('N_PROF', profiles_per_file)
+            ds.createDimension('N_LEVELS', n_levels)
+            ds.createDimension('STRING8', 8)
+
+            platform_number = ds.createVariable('PLATFORM_NUMBER', 'S1', ('N_PROF', 'STRING8'))
+            platform_number[:] = np.array([list(str(wmo).ljust(8))] * profiles_per_file, dtype='S1')
+            data_mode = ds.createVariable('DATA_MODE', 'S1', ('N_PROF',))
+            data_mode[:] = np.array([b'D'] * profiles_per_file)
+            ds.createVariable('CYCLE_NUMBER', 'i4', ('N_PROF',))[:] = cycle + np.arange(profiles_per_file)
+
+            juld = ds.createVariable('JULD', 'f8', ('N_PROF',))
+            juld.units = 'days since 1950-01-01 00:00:00 UTC'
+            juld[:] = 26000.0 + n * 10.0 + np.arange(profiles_per_file) * 0.01
+            ds.createVariable('LATITUDE', 'f8', ('N_PROF',))[:] = rng.uniform(-30, 25, profiles_per_file)
+            ds.createVariable('LONGITUDE', 'f8', ('N_PROF',))[:] = rng.uniform(40, 100, profiles_per_file)
+
+            pres = np.linspace(5.0, 2000.0, n_levels)[None, :] + rng.normal(0, 0.5, (profiles_per_file, n_levels))
+            temp = 4.0 + 24.0 * np.exp(-pres / 300.0) + rng.normal(0, 0.05, pres.shape)
+            psal = 34.7 + 0.6 * np.exp(-pres / 500.0) + rng.normal(0, 0.01, pres.shape)
+            fields = {'PRES': pres, 'TEMP': temp, 'PSAL': psal}
+            if bgc:
+                fields['DOXY'] = 200.0 * np.exp(-pres / 800.0) + rng.normal(0, 2, pres.shape)
+                fields['CHLA'] = np.clip(0.5 * np.exp(-pres / 60.0) + rng.normal(0, 0.01, pres.shape), 0, None)
+                fields['BBP700'] = 1e-3 * np.exp(-pres / 100.0)
+                fields['NITRATE'] = 35.0 * (1.0 - np.exp(-pres / 400.0))
+            for name, values in fields.items():
+                var = ds.createVariable(name, 'f4', ('N_PROF', 'N_LEVELS'), fill_value=np.float32(99999.0))
+                # Blank out a few trailing levels like real profiles that stop short
+                values = values.astype(np.float32)
+                values[:, n_levels - max(1, n_levels // 20):] = np.nan
+                var[:] = np.ma.masked_invalid(values)
+        paths.append(path)
+    return paths
+
+
+# --- Local stand-ins ---
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    """
+    Minimal Ollama HTTP API: /api/tags, /api/generate (streaming or not) and /api/chat.
+    """
+    latency_s = 0.0
+    response_text = ("The profile shows a warm, fresh mixed layer over a sharp thermocline, "
+                     "with temperature decreasing and salinity stabilising at depth.")
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, body):
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.startswith('/api/tags'):
+            self._send_json({"models": [{"name": "phi3:latest", "model": "phi3:latest", "size": 0, "digest": "stub"}]})
+        else:
+            self._send_json({})
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.end_headers()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        request = json.loads(self.rfile.read(length) or b'{}')
+        time.sleep(self.latency_s)
+        now = datetime.utcnow().isoformat() + 'Z'
+        done = {"model": request.get("model", "stub"), "created_at": now, "done": True, "done_reason": "stop",
+                "prompt_eval_count": len(str(request.get("prompt", ""))) // 4, "eval_count": len(self.response_text) // 4}
+
+        if self.path.startswith('/api/chat'):
+            self._send_json(dict(done, message={"role": "assistant", "content": self.response_text}))
+        elif request.get("stream", True):
+            lines = [dict(done, done=False, response=word + ' ') for word in self.response_text.split()]
+            lines.append(dict(done, response=''))
+            payload = b''.join(json.dumps(line).encode() + b'\n' for line in lines)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        else:
+            self._send_json(dict(done, response=self.response_text))
+
+
+def start_stub_ollama(latency_ms):
+    handler = type('ConfiguredStubOllamaHandler', (StubOllamaHandler,), {'latency_s': latency_ms / 1000.0})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class RecordingDBManager:
+    """
+    Stands in for DatabaseManager during the extraction stage so only NetCDF decoding is timed.
+    """
+    def __init__(self):
+        self.profiles = []
+        self.floats = {}
+
+    def get_or_create_float(self, wmo_number, project_name, platform_type):
+        return self.floats.setdefault(wmo_number, len(self.floats) + 1)
+
+    def check_profile_exists(self, float_id, cycle_number):
+        return False
+
+    def get_float_id(self, wmo_number):
+        return self.floats.get(wmo_number)
+
+    def get_existing_profiles(self, float_id):
+        return {}
+
+    def insert_profile(self, profile_data):
+        self.profiles.append(profile_data)
+        return len(self.profiles)
+
+    def enqueue_summaries(self, profile_ids):
+        pass
+
+
+def sqlite_engine(path):
+    """SQLite engine that hands DATETIME columns back as datetime objects, like MySQL does."""
+    sqlite3.register_converter("DATETIME", lambda b: datetime.fromisoformat(b.decode()))
+    return create_engine(f"sqlite:///{path}", connect_args={"detect_types": sqlite3.PARSE_DECLTYPES})
+
+
+# --- Measurement ---
+
+class StageTimer:
+    """Collects per-item latencies for one benchmark stage."""
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+        self.items = 0
+        self.wall_s = 0.0
+        self._lock = threading.Lock()
+
+    def time(self, fn, *args, items=1, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.samples.append(elapsed)
+            self.items += items
+        return result
+
+    def result(self):
+        total = self.wall_s or sum(self.samples)
+        ms = sorted(s * 1000.0 for s in self.samples)
+        out = {"items": self.items, "calls": len(ms), "total_s": round(total, 6),
+               "throughput_per_s": round(self.items / total, 3) if total else None}
+        if ms:
+            out.update({
+                "mean_ms": round(statistics.fmean(ms), 4),
+                "p50_ms": round(ms[len(ms) // 2], 4),
+                "p95_ms": round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 4),
+                "max_ms": round(ms[-1], 4),
+            })
+        return out
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Returns a list of regressions: stages whose p50 latency grew, or throughput dropped, by more than tolerance.
+    """
+    regressions = []
+    for stage, current in results["stages"].items():
+        previous = baseline.get("stages", {}).get(stage)
+        if not previous:
+            continue
+        if previous.get("p50_ms") and current.get("p50_ms") and current["p50_ms"] > previous["p50_ms"] * (1 + tolerance):
+            regressions.append(f"{stage}: p50 {previous['p50_ms']}ms -> {current['p50_ms']}ms")
+        if (previous.get("throughput_per_s") and current.get("throughput_per_s")
+                and current["throughput_per_s"] < previous["throughput_per_s"] * (1 - tolerance)):
+            regressions.append(f"{stage}: throughput {previous['throughput_per_s']}/s -> {current['throughput_per_s']}/s")
+    return regressions
+
+
+# --- Stages ---
+
+def run_benchmarks(args, work_dir):
+    stages = {}
+    data_dir = os.path.join(work_dir, 'data')
+
+    timer = StageTimer('generate_netcdf')
+    timer.time(generate_synthetic_argo_files, data_dir, args.files, args.profiles_per_file, args.levels,
+               bgc=args.bgc, items=args.files)
+    stages[timer.name] = timer.result()
+
+    # The Ollama python client reads OLLAMA_HOST when it is first imported
+    stub_server, stub_url = start_stub_ollama(args.stub_llm_latency_ms)
+    os.environ['OLLAMA_HOST'] = stub_url
+
+    from data_processor import ArgoDataProcessor
+    from database_manager import DatabaseManager
+    from llmbackend import ArgoRAG
+    from query_constraints import date_number
+
+    # 1. NetCDF extraction, with a recording stand-in so no database work is timed
+    recorder = RecordingDBManager()
+    timer = StageTimer('netcdf_extraction')
+    timer.time(ArgoDataProcessor(recorder).process_and_ingest, data_dir=data_dir, items=args.files)
+    stages[timer.name] = timer.result()
+    stages[timer.name]["profiles"] = len(recorder.profiles)
+
+    # 2. SQL writes
+    engine = create_engine(args.mysql_url) if args.mysql_url else sqlite_engine(os.path.join(work_dir, 'bench.db'))
+    db_manager = DatabaseManager(mysql_engine=engine, chroma_path=os.path.join(work_dir, 'chroma'),
+                                 collection_name='benchmark_profiles', ollama_url=stub_url)
+    db_manager.create_mysql_tables()
+    wmo_of = {float_id: wmo for wmo, float_id in recorder.floats.items()}
+    float_ids = {}
+    timer = StageTimer('sql_write')
+    for profile in recorder.profiles:
+        float_id = float_ids.get(profile["float_id"])
+        if float_id is None:
+            float_id = float_ids[profile["float_id"]] = timer.time(
+                db_manager.get_or_create_float, wmo_of[profile["float_id"]], 'SYNTHETIC BENCHMARK', 'APEX', items=0)
+        profile["wmo_number"] = wmo_of[profile["float_id"]]
+        profile["float_id"] = float_id
+        profile["profile_id"] = timer.time(db_manager.insert_profile, profile)
+    stages[timer.name] = timer.result()
+
+    # 3. Embedding throughput, single and batched
+    documents = [
+        f"Profile {p['profile_id']} collected on {p['profile_time']:%Y-%m-%d} at {p['latitude']:.2f}, {p['longitude']:.2f}. "
+        + StubOllamaHandler.response_text
+        for p in recorder.profiles
+    ]
+    timer = StageTimer('embedding_single')
+    for doc in documents[:args.queries]:
+        timer.time(db_manager.embedding_model.encode, doc)
+    stages[timer.name] = timer.result()
+
+    timer = StageTimer('embedding_batch')
+    embeddings = []
+    for i in range(0, len(documents), args.batch_size):
+        batch = documents[i:i + args.batch_size]
+        embeddings.extend(timer.time(db_manager.embedding_model.encode, batch, items=len(batch)).tolist())
+    stages[timer.name] = timer.result()
+
+    # 4. Chroma add and query
+    timer = StageTimer('chroma_add')
+    for i in range(0, len(documents), args.batch_size):
+        batch = recorder.profiles[i:i + args.batch_size]
+        timer.time(
+            db_manager.chroma_collection.add,
+            ids=[f"profile_{p['profile_id']}" for p in batch],
+            embeddings=embeddings[i:i + args.batch_size],
+            documents=documents[i:i + args.batch_size],
+            metadatas=[{"profile_id_sql": p["profile_id"], "float_id_sql": str(p["wmo_number"]), "latitude": p["latitude"],
+                        "longitude": p["longitude"], "date": p["profile_time"].strftime('%Y-%m-%d'),
+                        "date_num": date_number(p["profile_time"]), "year": p["profile_time"].year,
+                        "month": p["profile_time"].month, "wmo_number": p["wmo_number"]} for p in batch],
+            items=len(batch),
+        )
+    stages[timer.name] = timer.result()
+
+    questions = [f"What is the temperature structure near {lat:.0f}N {lon:.0f}E?"
+                 for lat, lon in np.random.default_rng(1).uniform((0, 40), (25, 100), (args.queries, 2))]
+    query_embeddings = db_manager.embedding_model.encode(questions).tolist()
+    timer = StageTimer('chroma_query')
+    for emb in query_embeddings:
+        timer.time(db_manager.chroma_collection.query, query_embeddings=[emb], n_results=5)
+    stages[timer.name] = timer.result()
+
+    # 5. Ingest-time summarization against the stub LLM (prompt building, HTTP round trips, embedding, Chroma write)
+    timer = StageTimer('summarize_and_embed')
+    for p in recorder.profiles[:args.queries]:
+        timer.time(db_manager.add_profile_to_chromadb, p["profile_id"], str(p["wmo_number"]), p["cycle_number"],
+                   p["profile_time"], p["latitude"], p["longitude"], [],
+                   json.loads(p["pressure"]), json.loads(p["temperature"]), json.loads(p["salinity"]))
+    stages[timer.name] = timer.result()
+
+    # 6. Full RAG question answering with the stub LLM
+    rag = ArgoRAG(db_manager)
+    timer = StageTimer('rag_answer_question')
+    for question in questions:
+        timer.time(rag.answer_question, question)
+    stages[timer.name] = timer.result()
+
+    # 7. /get-question throughput through the Flask app, pointed at the benchmark collection
+    import ingestion as flask_app
+    flask_app.collection = db_manager.chroma_collection
+    flask_app.model = db_manager.embedding_model
+
+    def ask(question):
+        with flask_app.app.test_client() as client:
+            response = client.post('/get-question', json={"prompt": question})
+            response.get_data()
+            return response.status_code
+
+    timer = StageTimer('get_question')
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        statuses = list(pool.map(lambda q: timer.time(ask, q), questions))
+    timer.wall_s = time.perf_counter() - start
+    stages[timer.name] = timer.result()
+    stages[timer.name]["concurrency"] = args.concurrency
+    stages[timer.name]["errors"] = sum(1 for s in statuses if s != 200)
+
+    stub_server.shutdown()
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the ARGO ingest and query pipelines.")
+    parser.add_argument('--files', type=int, default=200, help="number of synthetic NetCDF files")
+    parser.add_argument('--profiles-per-file', type=int, default=1)
+    parser.add_argument('--levels', type=int, default=100)
+    parser.add_argument('--bgc', action='store_true', help="include DOXY/CHLA/BBP700/NITRATE")
+    parser.add_argument('--queries', type=int, default=50, help="number of queries/summaries per query stage")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=4, help="parallel /get-question clients")
+    parser.add_argument('--stub-llm-latency-ms', type=float, default=0.0)
+    parser.add_argument('--mysql-url', default=None, help="SQLAlchemy URL of a local MySQL; defaults to a SQLite file")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=None, help="previous results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative regression vs. the baseline")
+    parser.add_argument('--keep', action='store_true', help="keep the temporary work directory")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    work_dir = tempfile.mkdtemp(prefix='argo_bench_')
+    try:
+        stages = run_benchmarks(args, work_dir)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {
+        "timestamp": datetime.utcnow().isoformat() + 'Z',
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "parameters": {k: v for k, v in vars(args).items() if k not in ('output', 'baseline', 'keep')},
+        "stages": stages,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results["stages"], indent=2))
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("No regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+from datetime import datetime
+import numpy as np
+
+from config import (CHROMA_PERSIST_DIR, CHROMA_COLLECTION_NAME, CHROMA_HNSW_M, CHROMA_HNSW_CONSTRUCTION_EF,
+                    CHROMA_HNSW_SEARCH_EF, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME)
+from query_constraints import date_number
+
+# Pointer file naming the collection currently served; switched atomically by the reindex command
+ACTIVE_COLLECTION_FILE = 'active_collection.json'
+
+
+def active_collection_name(persist_dir=CHROMA_PERSIST_DIR, default=CHROMA_COLLECTION_NAME):
+    """
+    Returns the name of the collection readers should use: the last reindexed one, or the configured default.
+    """
+    path = os.path.join(persist_dir, ACTIVE_COLLECTION_FILE)
+    try:
+        with open(path) as f:
+            return json.load(f)["collection"]
+    except (OSError, ValueError, KeyError):
+        return default
+
+
+def switch_active_collection(name, persist_dir=CHROMA_PERSIST_DIR):
+    """
+    Points readers at another collection. The pointer is replaced in one rename, so it is never half-written.
+    """
+    path = os.path.join(persist_dir, ACTIVE_COLLECTION_FILE)
+    pointer = {"collection": name, "previous": active_collection_name(persist_dir),
+               "switched_at": datetime.utcnow().isoformat() + 'Z'}
+    with open(path + '.tmp', 'w') as f:
+        json.dump(pointer, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+    return pointer
+
+
+def migrate_metadata(metadata):
+    """
+    Brings old metadata up to date while copying: backfills the numeric date fields and the WMO number
+    used by the constraint filters in ArgoRAG.
+    """
+    if "date" in metadata and "date_num" not in metadata:
+        d = datetime.strptime(metadata["date"], '%Y-%m-%d').date()
+        metadata.update({"date_num": date_number(d), "year": d.year, "month": d.month})
+    if "wmo_number" not in metadata:
+        try:
+            metadata["wmo_number"] = int(metadata.get("float_id_sql"))
+        except (TypeError, ValueError):
+            pass
+    return metadata
+
+
+def backfill_metadata(collection, batch_size=1000):
+    """
+    Applies migrate_metadata to an existing collection in place (no rebuild), so entries written before the
+    date/WMO fields existed can be matched by the constraint filters. Returns the number of entries updated.
+    """
+    updated = 0
+    offset = 0
+    while True:
+        page = collection.get(include=['metadatas'], limit=batch_size, offset=offset)
+        if not page['ids']:
+            break
+        ids, metadatas = [], []
+        for entry_id, meta in zip(page['ids'], page['metadatas']):
+            migrated = migrate_metadata(dict(meta or {}))
+            if migrated != (meta or {}):
+                ids.append(entry_id)
+                metadatas.append(migrated)
+        if ids:
+            collection.update(ids=ids, metadatas=metadatas)
+            updated += len(ids)
+        offset += len(page['ids'])
+    logging.info(f"Backfilled metadata of {updated} entries in '{collection.name}'.")
+    return updated
+
+
+class ChromaReindexer:
+    """
+    Rebuilds the profile collection from its stored summaries, embeddings and metadata with new HNSW parameters.
+    """
+    def __init__(self, chroma_client, embedding_model=None, batch_size=1000):
+        self.client = chroma_client
+        self.embedding_model = embedding_model
+        self.batch_size = batch_size
+
+    def rebuild(self, source_name, target_name, m, construction_ef, search_ef, reembed=False):
+        """
+        Copies every entry of source_name into a new collection target_name.
+        Returns (ids, embeddings matrix) of the copied entries for the recall check.
+        """
+        source = self.client.get_collection(source_name)
+        target = self.client.create_collection(
+            name=target_name,
+            metadata={"hnsw:space": "cosine", "hnsw:M": m,
+                      "hnsw:construction_ef": construction_ef, "hnsw:search_ef": search_ef},
+        )
+
+        try:
+            return self._copy(source, target, reembed)
+        except Exception:
+            # Never leave a half-built collection behind
+            self.client.delete_collection(target_name)
+            raise
+
+    def _copy(self, source, target, reembed):
+        total = source.count()
+        all_ids, all_embeddings = [], []
+        offset = 0
+        start = time.perf_counter()
+        while offset < total:
+            batch = source.get(include=['embeddings', 'documents', 'metadatas'], limit=self.batch_size, offset=offset)
+            if not batch['ids']:
+                break
+            if reembed:
+                embeddings = self.embedding_model.encode(batch['documents'], batch_size=64).tolist()
+            else:
+                embeddings = [list(e) for e in batch['embeddings']]
+            target.add(
+                ids=batch['ids'],
+                embeddings=embeddings,
+                documents=batch['documents'],
+                metadatas=[migrate_metadata(dict(meta or {})) for meta in batch['metadatas']],
+            )
+            all_ids.extend(batch['ids'])
+            all_embeddings.append(np.asarray(embeddings, dtype=np.float32))
+            offset += len(batch['ids'])
+            logging.info(f"Reindexed {offset}/{total} entries into '{target.name}'.")
+
+        copied = target.count()
+        if copied != total:
+            raise RuntimeError(f"Reindex copied {copied} of {total} entries; not switching.")
+        logging.info(f"Built '{target.name}' with {copied} entries in {time.perf_counter() - start:.1f}s.")
+        matrix = np.concatenate(all_embeddings) if all_embeddings else np.empty((0, 0), dtype=np.float32)
+        return all_ids, matrix
+
+    def _fingerprints(self, collection):
+        """Returns {id: hash of the document} for every entry, read in pages."""
+        fingerprints = {}
+        offset = 0
+        while True:
+            page = collection.get(include=['documents'], limit=self.batch_size, offset=offset)
+            if not page['ids']:
+                break
+            for entry_id, document in zip(page['ids'], page['documents']):
+                fingerprints[entry_id] = hashlib.sha1((document or '').encode('utf-8')).hexdigest()
+            offset += len(page['ids'])
+        return fingerprints
+
+    def sync_delta(self, source_name, target_name, reembed=False, missing_only=False):
+        """
+        Brings target_name up to date with writes made to source_name after the copy started:
+        entries that are new or whose summary changed are upserted, entries gone from the source are deleted.
+        With missing_only, only entries absent from the target are copied; use it once target_name is live,
+        since summary workers then write there directly and its entries are newer than the source's.
+        Returns the number of entries changed in the target.
+        """
+        source = self.client.get_collection(source_name)
+        target = self.client.get_collection(target_name)
+        wanted = self._fingerprints(source)
+        present = self._fingerprints(target)
+        if missing_only:
+            changed = [i for i in wanted if i not in present]
+            removed = []
+        else:
+            changed = [i for i, fingerprint in wanted.items() if present.get(i) != fingerprint]
+            removed = [i for i in present if i not in wanted]
+
+        for start in range(0, len(changed), self.batch_size):
+            batch = source.get(ids=changed[start:start + self.batch_size], include=['embeddings', 'documents', 'metadatas'])
+            if not batch['ids']:
+                continue
+            if reembed:
+                embeddings = self.embedding_model.encode(batch['documents'], batch_size=64).tolist()
+            else:
+                embeddings = [list(e) for e in batch['embeddings']]
+            target.upsert(
+                ids=batch['ids'],
+                embeddings=embeddings,
+                documents=batch['documents'],
+                metadatas=[migrate_metadata(dict(meta or {})) for meta in batch['metadatas']],
+            )
+        if removed:
+            target.delete(ids=removed)
+        if changed or removed:
+            logging.info(f"Synced {len(changed)} new/changed and {len(removed)} removed entries into '{target_name}'.")
+        return len(changed) + len(removed)
+
+    def catch_up(self, source_name, target_name, reembed=False, missing_only=False, max_passes=5):
+        """
+        Repeats sync_delta until a pass finds nothing to copy. Returns False if writers kept up with it.
+        """
+        for _ in range(max_passes):
+            if self.sync_delta(source_name, target_name, reembed, missing_only) == 0:
+                return True
+        return False
+
+
+def leased_summary_rows():
+    """
+    Number of summary queue rows currently leased, i.e. summary workers in the middle of writing to ChromaDB.
+    Returns None when the queue cannot be checked.
+    """
+    try:
+        from sqlalchemy import create_engine
+        from summary_queue import SummaryQueue, LEASED
+        engine = create_engine(f"mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
+        return SummaryQueue(engine).counts()[LEASED]
+    except Exception as e:
+        logging.warning(f"Could not check the summary queue: {e}")
+        return None
+
+
+def recall_report(collection, ids, embeddings, k=5, n_queries=200, seed=0):
+    """
+    Measures HNSW recall@k and query latency against exact cosine search over the same embeddings.
+    Queries are stored embeddings with a little noise, so they look like real near-duplicate questions.
+    """
+    if len(ids) == 0:
+        return {"queries": 0}
+    rng = np.random.default_rng(seed)
+    k = min(k, len(ids))
+    picks = rng.choice(len(ids), size=min(n_queries, len(ids)), replace=False)
+    queries = embeddings[picks] + rng.normal(0, 0.01, (len(picks), embeddings.shape[1])).astype(np.float32)
+
+    normed = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    qnormed = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+    brute_ms, hnsw_ms, recalls = [], [], []
+    ids = np.asarray(ids)
+    for q in qnormed:
+        start = time.perf_counter()
+        scores = normed @ q
+        top = np.argpartition(-scores, k - 1)[:k]
+        exact = set(ids[top].tolist())
+        brute_ms.append((time.perf_counter() - start) * 1000.0)
+
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[q.tolist()], n_results=k, include=[])
+        hnsw_ms.append((time.perf_counter() - start) * 1000.0)
+        recalls.append(len(exact & set(result['ids'][0])) / k)
+
+    def pct(values, p):
+        return round(float(np.percentile(values, p)), 3)
+
+    return {
+        "entries": len(ids), "queries": len(picks), "k": k,
+        "recall_at_k": round(float(np.mean(recalls)), 4), "min_recall": round(float(np.min(recalls)), 4),
+        "hnsw_p50_ms": pct(hnsw_ms, 50), "hnsw_p95_ms": pct(hnsw_ms, 95),
+        "brute_force_p50_ms": pct(brute_ms, 50), "brute_force_p95_ms": pct(brute_ms, 95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rebuild the Chroma profile collection with tuned HNSW parameters.",
+        epilog="Summary workers may keep running: writes made during the copy are synced before the switch, "
+               "entries still missing from the new collection are copied after it, and workers move to the new collection between batches. Stop them (summary_queue.py work, "
+               "main.py) before using --drop-old; it refuses to drop while summary rows are leased.",
+    )
+    parser.add_argument('--m', type=int, default=CHROMA_HNSW_M, help="hnsw:M, graph links per node")
+    parser.add_argument('--construction-ef', type=int, default=CHROMA_HNSW_CONSTRUCTION_EF)
+    parser.add_argument('--search-ef', type=int, default=CHROMA_HNSW_SEARCH_EF)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--reembed', action='store_true', help="recompute embeddings from the stored summaries")
+    parser.add_argument('--eval-queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--min-recall', type=float, default=0.0, help="do not switch if recall@k is below this")
+    parser.add_argument('--no-switch', action='store_true', help="build and report without switching")
+    parser.add_argument('--drop-old', action='store_true', help="delete the previous collection after switching")
+    parser.add_argument('--report', default=None, help="write the recall/latency report to this JSON file")
+    parser.add_argument('--backfill-metadata', action='store_true',
+                        help="only add missing date/WMO metadata to the active collection in place, without rebuilding")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    import chromadb
+    client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
+    embedding_model = None
+    if args.reembed:
+        from sentence_transformers import SentenceTransformer
+        embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+
+    source_name = active_collection_name()
+    if args.backfill_metadata:
+        backfill_metadata(client.get_collection(source_name), batch_size=args.batch_size)
+        return
+
+    target_name = f"{CHROMA_COLLECTION_NAME}_{datetime.utcnow():%Y%m%d%H%M%S}"
+    reindexer = ChromaReindexer(client, embedding_model, batch_size=args.batch_size)
+    ids, embeddings = reindexer.rebuild(source_name, target_name, args.m, args.construction_ef, args.search_ef,
+                                        reembed=args.reembed)
+
+    report = recall_report(client.get_collection(target_name), ids, embeddings, k=args.k, n_queries=args.eval_queries)
+    report.update({"source": source_name, "target": target_name, "hnsw:M": args.m,
+                   "hnsw:construction_ef": args.construction_ef, "hnsw:search_ef": args.search_ef})
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.no_switch:
+        logging.info(f"Built '{target_name}' without switching; '{source_name}' is still active.")
+        return
+    if report.get("recall_at_k", 1.0) < args.min_recall:
+        logging.error(f"Recall {report['recall_at_k']} is below --min-recall {args.min_recall}; keeping '{source_name}'.")
+        return
+
+    # Summary workers may have upserted into the source while it was being copied
+    if not reindexer.catch_up(source_name, target_name, reembed=args.reembed):
+        logging.error(f"'{source_name}' is still changing faster than it can be synced; not switching. Stop the summary workers and retry.")
+        return
+    switch_active_collection(target_name)
+    # Entries written to the old collection by batches that started before the switch. The new collection
+    # is live now, so nothing in it is deleted or overwritten with the older copy
+    reindexer.catch_up(source_name, target_name, reembed=args.reembed, missing_only=True)
+    logging.info(f"Switched active collection from '{source_name}' to '{target_name}'. "
+                 f"Summary workers follow it between batches; restart readers (app.py, ingestion.py, viz.py) to pick it up.")
+    if args.drop_old:
+        leased = leased_summary_rows()
+        if leased != 0:
+            logging.error(f"Not deleting '{source_name}': summary workers may still be writing to it "
+                          f"({'unknown' if leased is None else leased} leased rows). Stop them and delete it later.")
+            return
+        reindexer.catch_up(source_name, target_name, reembed=args.reembed, missing_only=True)
+        client.delete_collection(source_name)
+        logging.info(f"Deleted old collection '{source_name}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+import os
+import json
+import shutil
+import logging
+import argparse
+from datetime import datetime
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from sqlalchemy import text
+
+from config import COLUMNAR_STORE_DIR, COLUMNAR_PARTITION_BY
+from database_manager import DatabaseManager
+
+# Variables stored in the flat levels files, in column order
+LEVEL_VARIABLES = ['pressure', 'temperature', 'salinity', 'DOXY', 'CHLA', 'BBP700', 'NITRATE']
+BGC_VARIABLES = ['DOXY', 'CHLA', 'BBP700', 'NITRATE']
+
+# Size of the lat/lon boxes used when partitioning by region
+REGION_BOX_DEGREES = 10
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def _partition_key(row, partition_by):
+    """Returns the hive-style partition path for a profile row."""
+    if partition_by == 'month':
+        t = row['profile_time']
+        return f"year={t.year:04d}/month={t.month:02d}"
+    if partition_by == 'region':
+        lat_box = int(np.floor(row['latitude'] / REGION_BOX_DEGREES) * REGION_BOX_DEGREES)
+        lon_box = int(np.floor(row['longitude'] / REGION_BOX_DEGREES) * REGION_BOX_DEGREES)
+        return f"lat={lat_box}/lon={lon_box}"
+    raise ValueError(f"Unknown partitioning scheme: '{partition_by}'")
+
+
+def _to_array(values, length):
+    """Converts a decoded JSON list (None for missing) to a float32 array of the given length."""
+    out = np.full(length, np.nan, dtype=np.float32)
+    if values:
+        arr = np.asarray(values, dtype=np.float64)[:length]
+        out[:len(arr)] = arr
+    return out
+
+
+def _decode_json(value):
+    if value is None:
+        return None
+    if isinstance(value, (bytes, str)):
+        return json.loads(value)
+    return value
+
+
+class ArgoColumnarExporter:
+    """
+    Exports the MySQL profile tables to a partitioned Parquet store.
+
+    Layout under the store root:
+        floats.parquet                         float metadata
+        profiles/<partition>/part-<id>.parquet one row per profile, with level_offset/level_count
+        levels/<partition>/part-<id>.parquet   flat per-level values, indexed by the offsets above
+        manifest.json                          partitioning scheme and sync watermarks
+    """
+    def __init__(self, db_manager: DatabaseManager, root=COLUMNAR_STORE_DIR, partition_by=COLUMNAR_PARTITION_BY):
+        self.db_manager = db_manager
+        self.root = root
+        self.partition_by = partition_by
+
+    def export(self, batch_size=5000):
+        """
+        Rewrites the whole store from MySQL.
+        """
+        for sub in ('profiles', 'levels'):
+            shutil.rmtree(os.path.join(self.root, sub), ignore_errors=True)
+        manifest = {"partition_by": self.partition_by, "last_profile_id": 0, "last_updated_at": None}
+        self._write_manifest(manifest)
+        return self.sync(batch_size=batch_size)
+
+    def sync(self, batch_size=5000):
+        """
+        Appends profiles added to MySQL since the last export/sync as new part files, and replaces
+        profiles updated in place since then (e.g. delayed-mode data superseding real-time data).
+        """
+        manifest = self._read_manifest()
+        if manifest is None:
+            return self.export(batch_size=batch_size)
+        if manifest['partition_by'] != self.partition_by:
+            logging.warning(f"Store is partitioned by '{manifest['partition_by']}'; ignoring requested '{self.partition_by}'.")
+            self.partition_by = manifest['partition_by']
+
+        os.makedirs(self.root, exist_ok=True)
+        self._write_floats()
+
+        # Anything updated from here on is picked up by the next sync, even if this one also exports it
+        started_at = str(datetime.utcnow())
+        # Rows updated in place first, while last_profile_id still marks what the store holds
+        exported = self._sync_updated(manifest, batch_size)
+
+        last_id = manifest['last_profile_id']
+        query = text("""
+            SELECT p.profile_id, p.float_id, f.wmo_number, p.cycle_number, p.profile_time,
+                   p.latitude, p.longitude, p.pressure, p.temperature, p.salinity, p.bgc_params
+            FROM argo_profiles p
+            JOIN argo_floats f ON p.float_id = f.float_id
+            WHERE p.profile_id > :last_id
+            ORDER BY p.profile_id
+            LIMIT :batch_size
+        """)
+        while True:
+            with self.db_manager.mysql_engine.connect() as conn:
+                rows = [dict(r._mapping) for r in conn.execute(query, {"last_id": last_id, "batch_size": batch_size})]
+            if not rows:
+                break
+
+            partitions = {}
+            for row in rows:
+                partitions.setdefault(_partition_key(row, self.partition_by), []).append(row)
+            for key, part_rows in partitions.items():
+                self._write_part(key, part_rows)
+
+            last_id = rows[-1]['profile_id']
+            exported += len(rows)
+            manifest['last_profile_id'] = last_id
+            self._write_manifest(manifest)
+            logging.info(f"Exported {exported} profiles to the columnar store (up to profile_id {last_id}).")
+
+        manifest['last_updated_at'] = started_at
+        self._write_manifest(manifest)
+        return exported
+
+    def _sync_updated(self, manifest, batch_size):
+        """
+        Rewrites profiles already in the store whose MySQL row changed after the last sync.
+        Their old rows are removed from the part files that hold them and the new rows appended.
+        """
+        since = manifest.get('last_updated_at')
+        if not since or not manifest['last_profile_id']:
+            # Nothing exported yet, or a store written before updates were tracked (run an export to catch up)
+            return 0
+        # >= so rows written in the same second as the watermark are not missed; rewriting them is idempotent
+        query = text("""
+            SELECT p.profile_id, p.float_id, f.wmo_number, p.cycle_number, p.profile_time,
+                   p.latitude, p.longitude, p.pressure, p.temperature, p.salinity, p.bgc_params
+            FROM argo_profiles p
+            JOIN argo_floats f ON p.float_id = f.float_id
+            WHERE p.updated_at >= :since AND p.profile_id <= :last_id
+            ORDER BY p.profile_id
+        """)
+        with self.db_manager.mysql_engine.connect() as conn:
+            rows = [dict(r._mapping) for r in conn.execute(query, {"since": since, "last_id": manifest['last_profile_id']})]
+        if not rows:
+            return 0
+
+        self._drop_profiles({r['profile_id'] for r in rows})
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            partitions = {}
+            for row in batch:
+                partitions.setdefault(_partition_key(row, self.partition_by), []).append(row)
+            for key, part_rows in partitions.items():
+                self._write_part(key, part_rows, suffix=f"-u{manifest.get('update_generation', 0) + 1}")
+        manifest['update_generation'] = manifest.get('update_generation', 0) + 1
+        self._write_manifest(manifest)
+        logging.info(f"Replaced {len(rows)} profiles updated in MySQL since {since}.")
+        return len(rows)
+
+    def _drop_profiles(self, profile_ids):
+        """
+        Rewrites every part file holding any of profile_ids without them. The rewritten part is written
+        under a new name before the old one is removed, so readers see a duplicate at worst, never a
+        profiles file whose offsets do not match its levels file.
+        """
+        value_set = pa.array(sorted(profile_ids), pa.int32())
+        reader = ArgoColumnarReader(self.root)
+        for key, name, path in list(reader._part_files('profiles', reader.partitions())):
+            profiles = pq.read_table(path)
+            keep = pc.invert(pc.is_in(profiles.column('profile_id'), value_set=value_set)).to_numpy(zero_copy_only=False)
+            if keep.all():
+                continue
+            levels_path = os.path.join(self.root, 'levels', key, name)
+            if keep.any():
+                offsets = profiles.column('level_offset').to_numpy()[keep]
+                counts = profiles.column('level_count').to_numpy()[keep]
+                levels = pq.read_table(levels_path).take(pa.array(
+                    np.concatenate([np.arange(o, o + c) for o, c in zip(offsets, counts)]) if len(counts) else np.empty(0, np.int64)
+                ))
+                new_offsets = np.zeros(len(counts), dtype=np.int64)
+                np.cumsum(counts[:-1], out=new_offsets[1:])
+                kept = profiles.filter(pa.array(keep))
+                kept = kept.set_column(kept.schema.get_field_index('level_offset'), 'level_offset', pa.array(new_offsets))
+                new_name = name.replace('.parquet', '-r.parquet')
+                self._atomic_write(levels, os.path.join(self.root, 'levels', key, new_name))
+                self._atomic_write(kept, os.path.join(self.root, 'profiles', key, new_name))
+            os.remove(path)
+            os.remove(levels_path)
+
+    def _write_floats(self):
+        with self.db_manager.mysql_engine.connect() as conn:
+            rows = [dict(r._mapping) for r in conn.execute(text(
+                "SELECT float_id, wmo_number, project_name, platform_type FROM argo_floats ORDER BY float_id"
+            ))]
+        table = pa.Table.from_pylist(rows, schema=pa.schema([
+            ('float_id', pa.int32()), ('wmo_number', pa.int32()),
+            ('project_name', pa.string()), ('platform_type', pa.string()),
+        ]))
+        self._atomic_write(table, os.path.join(self.root, 'floats.parquet'))
+
+    def _write_part(self, key, rows, suffix=''):
+        """
+        Writes one profiles part file and its matching levels part file.
+        Level offsets are relative to the levels file written alongside.
+        """
+        counts = np.empty(len(rows), dtype=np.int32)
+        columns = {var: [] for var in LEVEL_VARIABLES}
+        for i, row in enumerate(rows):
+            core = {var: _decode_json(row[var]) for var in ('pressure', 'temperature', 'salinity')}
+            bgc = _decode_json(row['bgc_params']) or {}
+            n = max(len(v) for v in core.values() if v) if any(core.values()) else 0
+            counts[i] = n
+            for var in ('pressure', 'temperature', 'salinity'):
+                columns[var].append(_to_array(core[var], n))
+            for var in BGC_VARIABLES:
+                columns[var].append(_to_array(bgc.get(var), n))
+        offsets = np.zeros(len(rows), dtype=np.int64)
+        np.cumsum(counts[:-1], out=offsets[1:])
+
+        profiles = pa.table({
+            'profile_id': pa.array([r['profile_id'] for r in rows], pa.int32()),
+            'float_id': pa.array([r['float_id'] for r in rows], pa.int32()),
+            'wmo_number': pa.array([r['wmo_number'] for r in rows], pa.int32()),
+            'cycle_number': pa.array([r['cycle_number'] for r in rows], pa.int32()),
+            'profile_time': pa.array([r['profile_time'] for r in rows], pa.timestamp('s')),
+            'latitude': pa.array([r['latitude'] for r in rows], pa.float32()),
+            'longitude': pa.array([r['longitude'] for r in rows], pa.float32()),
+            'level_offset': pa.array(offsets),
+            'level_count': pa.array(counts),
+        })
+        levels = pa.table({var: pa.array(np.concatenate(vals) if vals else np.empty(0, np.float32))
+                           for var, vals in columns.items()})
+
+        part_name = f"part-{rows[0]['profile_id']:010d}{suffix}.parquet"
+        # Levels first, so a reader never sees a profiles file without its levels
+        self._atomic_write(levels, os.path.join(self.root, 'levels', key, part_name))
+        self._atomic_write(profiles, os.path.join(self.root, 'profiles', key, part_name))
+
+    @staticmethod
+    def _atomic_write(table, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+
+    def _read_manifest(self):
+        path = os.path.join(self.root, MANIFEST_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, MANIFEST_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+
+class ArgoColumnarReader:
+    """
+    Memory-mapped reader for the store written by ArgoColumnarExporter.
+    Only the requested columns and partitions are touched on disk.
+    """
+    def __init__(self, root=COLUMNAR_STORE_DIR):
+        self.root = root
+
+    def partitions(self, **filters):
+        """
+        Lists partition paths, optionally filtered by partition key values,
+        e.g. partitions(year=2023, month=3) or partitions(lat=0).
+        """
+        base = os.path.join(self.root, 'profiles')
+        if not os.path.isdir(base):
+            return []
+        found = []
+        for dirpath, dirnames, filenames in os.walk(base):
+            if not any(f.endswith('.parquet') for f in filenames):
+                continue
+            key = os.path.relpath(dirpath, base).replace(os.sep, '/')
+            values = dict(part.split('=', 1) for part in key.split('/'))
+            if all(k in values and int(values[k]) == int(v) for k, v in filters.items()):
+                found.append(key)
+        return sorted(found)
+
+    def _part_files(self, kind, partitions):
+        for key in partitions:
+            directory = os.path.join(self.root, kind, key)
+            for name in sorted(os.listdir(directory)):
+                if name.endswith('.parquet'):
+                    yield key, name, os.path.join(directory, name)
+
+    def read_floats(self, columns=None):
+        return pq.read_table(os.path.join(self.root, 'floats.parquet'), columns=columns, memory_map=True)
+
+    def read_profiles(self, columns=None, partitions=None, **filters):
+        """
+        Returns a pyarrow Table of profile rows for the selected partitions.
+        """
+        if partitions is None:
+            partitions = self.partitions(**filters)
+        tables = [pq.read_table(path, columns=columns, memory_map=True)
+                  for _, _, path in self._part_files('profiles', partitions)]
+        if not tables:
+            return None
+        return pa.concat_tables(tables)
+
+    def iter_levels(self, variables=('pressure', 'temperature', 'salinity'), profile_columns=('profile_id',),
+                    partitions=None, **filters):
+        """
+        Yields (profiles_table, {variable: values}, offsets, counts) per part file.
+        Values are zero-copy numpy views over the memory-mapped column where possible;
+        profile i spans values[offsets[i]:offsets[i] + counts[i]].
+        """
+        if partitions is None:
+            partitions = self.partitions(**filters)
+        columns = list(dict.fromkeys(list(profile_columns) + ['level_offset', 'level_count']))
+        for key, name, path in self._part_files('profiles', partitions):
+            profiles = pq.read_table(path, columns=columns, memory_map=True)
+            levels = pq.read_table(os.path.join(self.root, 'levels', key, name),
+                                   columns=list(variables), memory_map=True)
+            values = {var: levels.column(var).to_numpy() for var in variables}
+            yield (profiles.drop(['level_offset', 'level_count']), values,
+                   profiles.column('level_offset').to_numpy(), profiles.column('level_count').to_numpy())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export ARGO profiles from MySQL to a columnar Parquet store.")
+    parser.add_argument('command', choices=['export', 'sync'],
+                        help="'export' rewrites the store, 'sync' applies profiles added or updated since the last run")
+    parser.add_argument('--root', default=COLUMNAR_STORE_DIR)
+    parser.add_argument('--partition-by', default=COLUMNAR_PARTITION_BY, choices=['month', 'region'])
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    db_manager = DatabaseManager()
+    exporter = ArgoColumnarExporter(db_manager, root=args.root, partition_by=args.partition_by)
+    if args.command == 'export':
+        count = exporter.export(batch_size=args.batch_size)
+    else:
+        count = exporter.sync(batch_size=args.batch_size)
+    logging.info(f"Columnar {args.command} finished: {count} profiles written to '{args.root}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,7 +11,66 @@ DB_PASSWORD = 'shyam123'
 DB_HOST = 'localhost'
 DB_PORT = '3306'
 DB_NAME = 'argo_ocean_data'
+# Optional read replica for heavy interactive queries from viz.py (None: no replica, heavy queries are refused)
+DB_REPLICA_HOST = None
+DB_REPLICA_PORT = DB_PORT
 
 # ChromaDB Configuration
 CHROMA_PERSIST_DIR = 'chroma_db_storage'
 CHROMA_COLLECTION_NAME = 'argo_float_profiles'
+
+# Columnar analytics store (Parquet export of the MySQL profile tables)
+COLUMNAR_STORE_DIR = 'columnar_store'
+COLUMNAR_PARTITION_BY = 'month'  # 'month' or 'region'
+
+# In-memory spatial index over profile positions (grid cell size in degrees)
+SPATIAL_INDEX_CELL_DEGREES = 2.0
+# Serving processes pick up profiles ingested elsewhere at most this often (seconds)
+SPATIAL_INDEX_REFRESH_SECONDS = 60
+
+# Ollama server used to summarize profiles during ingestion
+OLLAMA_URL = 'http://10.176.0.140:11434'
+SUMMARY_MODEL = 'llama3.1:8b'
+
+# Summary queue: profiles are ingested into MySQL first, then summarized/embedded by workers
+SUMMARY_WORKERS = 2
+SUMMARY_BATCH_SIZE = 10
+SUMMARY_MAX_ATTEMPTS = 5
+SUMMARY_LEASE_SECONDS = 600
+SUMMARY_REQUEST_TIMEOUT_SECONDS = 300  # total time for one profile's Ollama requests; below the lease, which is renewed per profile
+SUMMARY_BACKOFF_SECONDS = 30
+SUMMARY_BACKOFF_MAX_SECONDS = 3600
+SUMMARY_POLL_SECONDS = 5
+SUMMARIZE_AFTER_INGEST = True  # drain the queue at the end of main.py runs
+
+# HNSW parameters used by chroma_reindex.py (Chroma's defaults)
+CHROMA_HNSW_M = 16
+CHROMA_HNSW_CONSTRUCTION_EF = 100
+CHROMA_HNSW_SEARCH_EF = 10
+
+# Token budget for the RAG prompt built by context_builder.py
+CONTEXT_TOKEN_BUDGET = 1200
+# Keeps phi3 loaded between questions so its cached prompt prefix can be reused
+GENERATION_KEEP_ALIVE = '30m'
+
+# RAG serving (rag_service.py): phi3 generations run concurrently by the workers, requests allowed to wait
+# for one, and how long a question may take before the user is told to retry
+RAG_GENERATION_WORKERS = 1
+RAG_MAX_QUEUED_GENERATIONS = 8
+RAG_REQUEST_TIMEOUT_SECONDS = 120
+
+# Guardrails for LLM-generated SQL in viz.py (sql_guard.py): rows returned, server-side time limit, and
+# EXPLAIN row estimates above which a query goes to the replica or is refused outright
+SQL_GUARD_MAX_ROWS = 1000
+SQL_GUARD_MAX_EXECUTION_MS = 5000
+SQL_GUARD_REPLICA_ROWS = 100000
+SQL_GUARD_MAX_ESTIMATED_ROWS = 5000000
+# EXPLAIN puts every JSON_TABLE at ~2 rows; cost each one as a full profile of this many levels instead
+SQL_GUARD_TABLE_FUNCTION_ROWS = 1000
+
+# Prometheus endpoints of the processes that do not run the Flask app (0 disables), and how often
+# long-running summary workers log their per-stage timings
+INGEST_METRICS_PORT = 9101
+SUMMARY_METRICS_PORT = 9102
+RAG_METRICS_PORT = 9103  # the Streamlit chat (app.py): retrieval, generation and queue-wait timings
+METRICS_LOG_SECONDS = 300
@@ -0,0 +1,152 @@
+import re
+import json
+import math
+import numpy as np
+
+# Kept byte-for-byte identical across questions so Ollama can reuse the cached prompt prefix
+PROMPT_PREFIX = """You are an expert oceanographic data analyst. Answer the user's question based *only* on the provided ARGO float data.
+If the context is insufficient, state that you cannot answer from the given data. Do not use external knowledge. Be concise.
+
+Each data point lists representative depth levels as "label pressure_dbar: values".
+Temperature (T) is in °C and salinity (S) in PSU.
+
+Context:
+"""
+
+TEMPERATURE_WORDS = re.compile(r"temp|warm|cold|heat|thermo|sst|mixed layer", re.IGNORECASE)
+SALINITY_WORDS = re.compile(r"salin|fresh|psu|salt|halo", re.IGNORECASE)
+
+# de Boyer Montégut et al. (2004): mixed layer ends where T drops 0.2 °C below its value at 10 dbar
+MLD_REFERENCE_DBAR = 10.0
+MLD_TEMPERATURE_THRESHOLD = 0.2
+
+
+def estimate_tokens(text):
+    """Rough token count for budgeting (about four characters per token for English/numeric text)."""
+    return math.ceil(len(text) / 4)
+
+
+def _as_array(values):
+    if values is None:
+        return None
+    if isinstance(values, (str, bytes)):
+        values = json.loads(values)
+    return np.asarray(values, dtype=np.float64)
+
+
+def representative_levels(pressure, temperature=None):
+    """
+    Picks the surface, base of the mixed layer, thermocline (steepest temperature drop) and deepest level.
+    Returns an ordered {label: index} dict; labels are omitted when they cannot be determined.
+    """
+    pressure = _as_array(pressure)
+    if pressure is None or pressure.size == 0:
+        return {}
+    valid = ~np.isnan(pressure)
+    if temperature is not None:
+        temperature = _as_array(temperature)
+        if temperature.shape != pressure.shape:
+            temperature = None
+        else:
+            valid &= ~np.isnan(temperature)
+    idx = np.flatnonzero(valid)
+    if idx.size == 0:
+        return {}
+
+    p = pressure[idx]
+    order = np.argsort(p, kind='stable')
+    idx, p = idx[order], p[order]
+    levels = {"surface": int(idx[0])}
+
+    if temperature is not None and idx.size >= 3:
+        t = temperature[idx]
+        ref = int(np.argmin(np.abs(p - MLD_REFERENCE_DBAR)))
+        below = np.flatnonzero((p > p[ref]) & (t < t[ref] - MLD_TEMPERATURE_THRESHOLD))
+        # No threshold crossing means the whole profile is mixed; the mixed layer base is then unknown
+        mld = int(below[0]) - 1 if below.size else None
+        if mld:
+            levels["mixed layer"] = int(idx[mld])
+
+        dp = np.diff(p)
+        gradient = np.where(dp > 0, -np.diff(t) / np.where(dp > 0, dp, 1.0), -np.inf)
+        gradient[:mld or 0] = -np.inf
+        if np.isfinite(gradient).any() and gradient.max() > 0:
+            k = int(np.argmax(gradient))
+            levels["thermocline"] = int(idx[k + 1])
+
+    if idx[-1] != idx[0]:
+        levels["deepest"] = int(idx[-1])
+
+    # Drop labels pointing at a level already listed
+    seen, unique = set(), {}
+    for label, i in levels.items():
+        if i not in seen:
+            seen.add(i)
+            unique[label] = i
+    return unique
+
+
+class ContextBuilder:
+    """
+    Builds token-budgeted RAG prompts with a few representative depth levels per profile.
+    """
+    def __init__(self, token_budget=1200):
+        self.token_budget = token_budget
+
+    @staticmethod
+    def _variables_for(question):
+        wants_t = bool(TEMPERATURE_WORDS.search(question))
+        wants_s = bool(SALINITY_WORDS.search(question))
+        if not wants_t and not wants_s:
+            wants_t = wants_s = True
+        return wants_t, wants_s
+
+    @staticmethod
+    def _format_profile(n, item, wants_t, wants_s):
+        pressure = _as_array(item.get('pressure'))
+        temperature = _as_array(item.get('temperature'))
+        salinity = _as_array(item.get('salinity'))
+        when = item.get('profile_time').strftime('%Y-%m-%d') if item.get('profile_time') else 'N/A'
+        lines = [f"[{n}] WMO {item.get('wmo_number', 'N/A')} | {when} | "
+                 f"{item.get('latitude', 0.0):.2f}, {item.get('longitude', 0.0):.2f}"]
+
+        if pressure is None:
+            lines.append("  no depth data")
+            return "\n".join(lines) + "\n"
+
+        levels = representative_levels(pressure, temperature)
+        for label, i in levels.items():
+            values = []
+            if wants_t and temperature is not None and i < temperature.size and not np.isnan(temperature[i]):
+                values.append(f"T {temperature[i]:.2f}")
+            if wants_s and salinity is not None and i < salinity.size and not np.isnan(salinity[i]):
+                values.append(f"S {salinity[i]:.3f}")
+            if values:
+                lines.append(f"  {label} {pressure[i]:.0f}: {', '.join(values)}")
+        return "\n".join(lines) + "\n"
+
+    def build(self, question: str, context_data: list):
+        """
+        Returns (prompt, stats). Profiles are added in retrieval order until the token budget is reached.
+        """
+        wants_t, wants_s = self._variables_for(question)
+        suffix = f'\nQuestion: "{question}"\n\nAnswer:\n'
+        used = estimate_tokens(PROMPT_PREFIX) + estimate_tokens(suffix)
+
+        blocks = []
+        for n, item in enumerate(context_data, 1):
+            block = self._format_profile(n, item, wants_t, wants_s)
+            cost = estimate_tokens(block)
+            if blocks and used + cost > self.token_budget:
+                break
+            blocks.append(block)
+            used += cost
+
+        prompt = PROMPT_PREFIX + "\n".join(blocks) + suffix
+        stats = {
+            "profiles_available": len(context_data),
+            "profiles_included": len(blocks),
+            "estimated_prompt_tokens": estimate_tokens(prompt),
+            "token_budget": self.token_budget,
+        }
+        return prompt, stats
@@ -8,6 +8,9 @@ from tqdm import tqdm
 
 from config import ARGO_DATA_DIR
 from database_manager import DatabaseManager
+from metrics import metrics
+from netcdf_reader import read_argo_file, BGC_VARIABLES
+from argo_files import parse_profile_filename, resolve_preferred_files, data_mode_rank
 
 class ArgoDataProcessor:
     """
@@ -16,92 +19,198 @@ class ArgoDataProcessor:
     def __init__(self, db_manager: DatabaseManager):
         self.db_manager = db_manager
 
-    def process_and_ingest(self):
+    def process_and_ingest(self, data_dir=ARGO_DATA_DIR):
         """
         Finds, processes, and ingests all ARGO .nc files from the specified directory.
+        Files are handled in batches per float so float lookups and existence checks run once per float.
         """
-        nc_files = [os.path.join(ARGO_DATA_DIR, f) for f in os.listdir(ARGO_DATA_DIR) if f.endswith('.nc')]
+        nc_files = [os.path.join(data_dir, f) for f in os.listdir(data_dir) if f.endswith('.nc')]
         if not nc_files:
-            logging.error(f"No NetCDF (.nc) files found in '{ARGO_DATA_DIR}'. Please check the path.")
+            logging.error(f"No NetCDF (.nc) files found in '{data_dir}'. Please check the path.")
             return
 
-        logging.info(f"Found {len(nc_files)} NetCDF files to process.")
-
-        for nc_file_path in tqdm(nc_files, desc="Processing ARGO files"):
-            try:
-                # Use decode_times=False to handle time conversion manually and avoid potential issues
-                with xr.open_dataset(nc_file_path, decode_times=False) as ds:
-                    wmo_number = int(ds['PLATFORM_NUMBER'].values[0].decode().strip())
-                    project_name = ds.attrs.get('project_name', 'N/A')
-                    platform_type = ds.attrs.get('platform_type', 'N/A')
-
-                    float_id_db = self.db_manager.get_or_create_float(wmo_number, project_name, platform_type)
-                    float_id = ds["PLATFORM_NUMBER"].values
-                    float_id = str(float_id[0])
-                    float_id = float_id[2:-1].strip()
+        # Of an R and a D file for the same cycle only the delayed-mode one is read
+        nc_files, superseded = resolve_preferred_files(nc_files)
+        if superseded:
+            logging.info(f"Skipping {len(superseded)} files superseded by delayed-mode or ascending profiles.")
+            metrics.inc('argo_files_superseded_total', len(superseded), help_text="Files skipped because a preferred file for the same cycle exists.")
 
+        batches = self._group_files_by_float(nc_files)
+        logging.info(f"Found {len(nc_files)} NetCDF files from {len(batches)} floats to process.")
+        metrics.set_queue_depth('ingest_files', len(nc_files))
 
-                    # --- FIX for FutureWarning: Use .sizes instead of .dims ---
-                    num_profiles = ds.sizes['N_PROF']
-                    
-                    for i in range(num_profiles):
-                        self._process_single_profile(ds.isel(N_PROF=i), float_id_db, float_id)
+        with tqdm(total=len(nc_files), desc="Processing ARGO files") as progress:
+            for paths in batches.values():
+                self._ingest_float_batch(paths, progress)
 
+    @staticmethod
+    def _group_files_by_float(nc_files):
+        """
+        Groups file paths by the WMO number in their name; files with other names form one batch each.
+        """
+        batches = {}
+        for path in sorted(nc_files):
+            name = parse_profile_filename(path)
+            key = name['wmo'] if name else path
+            batches.setdefault(key, []).append(path)
+        return batches
+
+    def _ingest_float_batch(self, paths, progress):
+        """
+        Ingests all files of one float, reusing its database id and the profiles already loaded.
+        A cycle that is already loaded is only replaced when the new data has a better data mode (R < A < D).
+        """
+        float_ids = {}
+        existing_profiles = {}
+        for nc_file_path in paths:
+            try:
+                name = parse_profile_filename(nc_file_path)
+                if name and self._file_is_redundant(name, float_ids, existing_profiles):
+                    metrics.inc('argo_files_skipped_total', help_text="Files skipped without reading because their cycle is already loaded.")
+                    continue
+
+                float_info, profiles = self._read_file(nc_file_path)
+
+                wmo_number = float_info["wmo_number"]
+                loaded = self._loaded_profiles(wmo_number, float_ids, existing_profiles)
+                if float_ids[wmo_number] is None:
+                    float_ids[wmo_number] = self.db_manager.get_or_create_float(
+                        wmo_number, float_info["project_name"], float_info["platform_type"]
+                    )
+                float_id_db = float_ids[wmo_number]
+
+                changed = []
+                for profile in profiles:
+                    current = loaded.get(profile["cycle_number"])
+                    if current is None:
+                        profile_id = self._process_single_profile(profile, float_id_db)
+                    elif data_mode_rank(profile["data_mode"]) > data_mode_rank(current[1]):
+                        profile_id = self._process_single_profile(profile, float_id_db, replace_profile_id=current[0])
+                    else:
+                        metrics.inc('argo_profiles_skipped_total', help_text="Profiles skipped because they are already loaded.")
+                        continue
+                    loaded[profile["cycle_number"]] = (current[0] if profile_id is None else profile_id, profile["data_mode"] or None)
+                    if profile_id is not None:
+                        changed.append(profile_id)
+                # Summaries are produced later by the summary workers, so a slow LLM never stalls ingest.
+                # Replaced profiles are re-summarized too; the worker upserts their Chroma entry.
+                self.db_manager.enqueue_summaries(changed)
+
+                metrics.inc('argo_files_processed_total', help_text="NetCDF files processed by the ingest pipeline.")
             except Exception as e:
+                metrics.inc('argo_files_failed_total', help_text="NetCDF files that could not be processed.")
                 logging.warning(f"Could not process file {os.path.basename(nc_file_path)}: {e}", exc_info=False) # Set exc_info to False for cleaner logs
+            finally:
+                metrics.add_queue_depth('ingest_files', -1)
+                progress.update(1)
 
-    def _process_single_profile(self, profile_ds, float_id_db, float_id):
+    def _loaded_profiles(self, wmo_number, float_ids, existing_profiles):
         """
-        Processes a single profile, extracts data, and loads it into databases via the manager.
+        Returns {cycle_number: (profile_id, data_mode)} for a float, looking it up once per batch.
+        The float's id is cached as None until the float has been created.
         """
-        cycle_number = int(profile_ds['CYCLE_NUMBER'].values)
-
-        logging.info(f"info 1 ........", exc_info=False)
-        
-        if self.db_manager.check_profile_exists(float_id_db, cycle_number):
-            return
-
-        lat = float(profile_ds['LATITUDE'].values)
-        lon = float(profile_ds['LONGITUDE'].values)
+        if wmo_number not in existing_profiles:
+            float_id = self.db_manager.get_float_id(wmo_number)
+            float_ids[wmo_number] = float_id
+            existing_profiles[wmo_number] = self.db_manager.get_existing_profiles(float_id) if float_id else {}
+        return existing_profiles[wmo_number]
 
-        logging.info(f"info 2 ........", exc_info=False)
-        
+    def _file_is_redundant(self, name, float_ids, existing_profiles):
+        """
+        Decides from the file name alone whether reading the file could change anything.
+        """
+        current = self._loaded_profiles(name['wmo'], float_ids, existing_profiles).get(name['cycle'])
+        if current is None:
+            return False
+        # A descending profile never replaces a loaded cycle. An R file's profiles turn 'A' once the DAC adjusts
+        # them without renaming it, so an R file can only be skipped for rows that are already A or D
+        best_mode = 'A' if name['mode'] == 'R' else name['mode']
+        return name['descending'] or data_mode_rank(current[1]) >= data_mode_rank(best_mode)
+
+    def _read_file(self, nc_file_path):
+        """
+        Reads a file with the direct netCDF4 reader, falling back to xarray for layouts it cannot handle.
+        """
+        try:
+            # read_argo_file records file_open and extraction separately
+            return read_argo_file(nc_file_path)
+        except Exception as e:
+            logging.debug(f"Direct reader failed for {os.path.basename(nc_file_path)} ({e}); falling back to xarray.")
+            metrics.inc('argo_reader_fallbacks_total', help_text="Files read through the xarray fallback.")
+            return self._read_with_xarray(nc_file_path)
+
+    def _read_with_xarray(self, nc_file_path):
+        """
+        Reads a file through xarray into the same (float_info, profiles) shape as read_argo_file.
+        """
+        # Use decode_times=False to handle time conversion manually and avoid potential issues
+        with metrics.timer('file_open'):
+            ds = xr.open_dataset(nc_file_path, decode_times=False)
+        with ds, metrics.timer('extraction'):
+            float_info = {
+                "wmo_number": int(ds['PLATFORM_NUMBER'].values[0].decode().strip()),
+                "project_name": ds.attrs.get('project_name', 'N/A'),
+                "platform_type": ds.attrs.get('platform_type', 'N/A'),
+            }
+
+            # --- FIX for FutureWarning: Use .sizes instead of .dims ---
+            num_profiles = ds.sizes['N_PROF']
+            profiles = [self._extract_profile(ds.isel(N_PROF=i)) for i in range(num_profiles)]
+        return float_info, profiles
+
+    @staticmethod
+    def _extract_profile(profile_ds):
+        """
+        Extracts position, time and measurements of a single xarray profile.
+        """
         # JULD is days since 1950-01-01, handle conversion manually
         base_date = pd.Timestamp("1950-01-01")
         profile_time = base_date + pd.to_timedelta(profile_ds['JULD'].values, unit='D')
-        
+
         # --- FIX for JSON Serialization: Convert numpy.float32 to Python float ---
         def get_param(ds, var_name):
             if var_name in ds:
                 # For each value 'x', explicitly cast it to a Python float()
                 return [float(x) if not np.isnan(x) else None for x in ds[var_name].values.flatten()]
             return None
-        
-        logging.info(f"info 3 .......", exc_info=False)
 
-        pressure = get_param(profile_ds, 'PRES')
-        temperature = get_param(profile_ds, 'TEMP')
-        salinity = get_param(profile_ds, 'PSAL')
-        
-        bgc_params = {}
-        bgc_vars = ['DOXY', 'CHLA', 'BBP700', 'NITRATE']
-        for var in bgc_vars:
-            if var in profile_ds:
-                bgc_params[var] = get_param(profile_ds, var)
+        data_mode = profile_ds['DATA_MODE'].values.item() if 'DATA_MODE' in profile_ds else b''
+        return {
+            "cycle_number": int(profile_ds['CYCLE_NUMBER'].values),
+            "data_mode": (data_mode.decode() if isinstance(data_mode, bytes) else str(data_mode)).strip(),
+            "profile_time": profile_time.to_pydatetime(),
+            "latitude": float(profile_ds['LATITUDE'].values),
+            "longitude": float(profile_ds['LONGITUDE'].values),
+            "pressure": get_param(profile_ds, 'PRES'),
+            "temperature": get_param(profile_ds, 'TEMP'),
+            "salinity": get_param(profile_ds, 'PSAL'),
+            "bgc_params": {var: get_param(profile_ds, var) for var in BGC_VARIABLES if var in profile_ds},
+        }
 
-        logging.info(f"info 4 .........", exc_info=False)
+    def _process_single_profile(self, profile, float_id_db, replace_profile_id=None):
+        """
+        Loads one extracted profile into MySQL via the manager and returns its profile_id.
+        With replace_profile_id the existing row is overwritten instead of inserting a new one; if only the
+        data mode differs (e.g. rows loaded before data_mode was recorded), just the mode is stored and None
+        is returned, so the profile is not summarized again.
+        """
+        pressure, temperature, salinity = profile["pressure"], profile["temperature"], profile["salinity"]
+        bgc_params = profile["bgc_params"]
 
         profile_data = {
-            "float_id": float_id_db, "cycle_number": cycle_number, "profile_time": profile_time.to_pydatetime(),
-            "latitude": lat, "longitude": lon, 
+            "float_id": float_id_db, "cycle_number": profile["cycle_number"], "profile_time": profile["profile_time"],
+            "latitude": profile["latitude"], "longitude": profile["longitude"],
             "pressure": json.dumps(pressure) if pressure is not None else None,
-            "temperature": json.dumps(temperature) if temperature is not None else None, 
+            "temperature": json.dumps(temperature) if temperature is not None else None,
             "salinity": json.dumps(salinity) if salinity is not None else None,
-            "bgc_params": json.dumps(bgc_params) if bgc_params else None
+            "bgc_params": json.dumps(bgc_params) if bgc_params else None,
+            "data_mode": profile["data_mode"] or None,
         }
 
-        profile_id_db = self.db_manager.insert_profile(profile_data)
-        
-        self.db_manager.add_profile_to_chromadb(
-           profile_id_db, float_id, cycle_number, profile_time.to_pydatetime(), lat, lon, bgc_params.keys(), pressure, temperature, salinity
-        )
+        if replace_profile_id is not None:
+            if self.db_manager.profile_matches(replace_profile_id, profile_data):
+                self.db_manager.set_data_mode(replace_profile_id, profile_data["data_mode"])
+                metrics.inc('argo_profiles_mode_backfilled_total', help_text="Profiles whose data mode was recorded without changes.")
+                return None
+            return self.db_manager.update_profile(replace_profile_id, profile_data)
+        return self.db_manager.insert_profile(profile_data)
@@ -1,32 +1,82 @@
 import chromadb
 import json
 import requests
+from time import monotonic
+from datetime import datetime
 
 import logging
-from sqlalchemy import create_engine, text
+import numpy as np
+from sqlalchemy import create_engine, inspect, text
 from sentence_transformers import SentenceTransformer
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 # Import configurations from the config file
-from config import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME, CHROMA_PERSIST_DIR, CHROMA_COLLECTION_NAME
+from config import (DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME, CHROMA_PERSIST_DIR,
+                    SPATIAL_INDEX_CELL_DEGREES, SPATIAL_INDEX_REFRESH_SECONDS, OLLAMA_URL, SUMMARY_MODEL,
+                    SUMMARY_REQUEST_TIMEOUT_SECONDS)
+from spatial_index import ProfileSpatialIndex
+from metrics import metrics
+from summary_queue import SummaryQueue
+from chroma_reindex import active_collection_name
+from query_constraints import date_number
+
+def _as_datetime(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _same_values(a, b):
+    """Compares two decoded JSON value lists (None for missing) up to float32 round-off."""
+    if a is None or b is None:
+        return a is None and b is None
+    if len(a) != len(b):
+        return False
+    a = np.array([np.nan if v is None else v for v in a], dtype=np.float64)
+    b = np.array([np.nan if v is None else v for v in b], dtype=np.float64)
+    return bool(np.allclose(a, b, rtol=1e-6, atol=1e-6, equal_nan=True))
+
 
 class DatabaseManager:
     """
     Manages all database interactions for both MySQL and ChromaDB.
     """
-    def __init__(self):
+    def __init__(self, mysql_engine=None, chroma_path=CHROMA_PERSIST_DIR, collection_name=None,
+                 ollama_url=OLLAMA_URL):
         """
         Initializes database connections and the embedding model.
+        An existing SQLAlchemy engine (e.g. a SQLite stand-in) can be passed instead of the configured MySQL server.
+        Without a collection_name, the collection last switched in by chroma_reindex.py is used.
         """
-        self.mysql_engine = self._setup_mysql_connection()
-        self.chroma_client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
+        # Without an explicit name, writers follow the pointer that chroma_reindex.py switches
+        self.chroma_path = chroma_path
+        self.follows_active_collection = collection_name is None
+        if collection_name is None:
+            collection_name = active_collection_name(chroma_path)
+        self.mysql_engine = mysql_engine if mysql_engine is not None else self._setup_mysql_connection()
+        self.ollama_url = ollama_url
+        self.chroma_client = chromadb.PersistentClient(path=chroma_path)
         self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
         self.chroma_collection = self.chroma_client.get_or_create_collection(
-            name=CHROMA_COLLECTION_NAME,
+            name=collection_name,
             metadata={"hnsw:space": "cosine"}
         )
+        self.summary_queue = SummaryQueue(self.mysql_engine)
+        self.spatial_index = ProfileSpatialIndex(cell_degrees=SPATIAL_INDEX_CELL_DEGREES)
+        self._spatial_index_checked_at = 0.0
+        self.load_spatial_index()
         logging.info("Database connections and embedding model initialized.")
 
+    def follow_active_collection(self):
+        """
+        Switches to the active collection if chroma_reindex.py has switched it since this manager was created.
+        Summary workers call this between batches, so they stop writing to a collection that is being retired.
+        """
+        if not self.follows_active_collection:
+            return
+        name = active_collection_name(self.chroma_path)
+        if name != self.chroma_collection.name:
+            logging.info(f"Active ChromaDB collection changed from '{self.chroma_collection.name}' to '{name}'.")
+            self.chroma_collection = self.chroma_client.get_or_create_collection(name=name, metadata={"hnsw:space": "cosine"})
+
     def _setup_mysql_connection(self):
         """
         Establishes a connection to the MySQL database.
@@ -42,6 +92,30 @@ class DatabaseManager:
             logging.error("Please ensure MySQL is running and connection details are correct.")
             exit()
 
+    def load_spatial_index(self):
+        """
+        (Re)loads the in-memory spatial index from the argo_profiles table.
+        """
+        try:
+            self.spatial_index.load(self.mysql_engine)
+            self._spatial_index_checked_at = monotonic()
+        except Exception as e:
+            # The table does not exist yet on a first run; ingest fills the index as it goes
+            logging.warning(f"Could not load spatial index from MySQL: {e}")
+
+    def refresh_spatial_index(self, max_age=SPATIAL_INDEX_REFRESH_SECONDS):
+        """
+        Adds profiles ingested by other processes (main.py) since the last check, at most once per max_age seconds.
+        """
+        if monotonic() - self._spatial_index_checked_at < max_age:
+            return
+        self._spatial_index_checked_at = monotonic()
+        try:
+            with metrics.timer('spatial_refresh'):
+                self.spatial_index.refresh(self.mysql_engine)
+        except Exception as e:
+            logging.warning(f"Could not refresh spatial index from MySQL: {e}")
+
     def create_mysql_tables(self):
         """
         Creates the necessary tables in the MySQL database if they don't already exist.
@@ -66,63 +140,181 @@ class DatabaseManager:
             temperature JSON,
             salinity JSON,
             bgc_params JSON,
+            data_mode CHAR(1),
+            updated_at DATETIME,
             FOREIGN KEY (float_id) REFERENCES argo_floats(float_id),
-            UNIQUE KEY (float_id, cycle_number)
+            UNIQUE (float_id, cycle_number)
         );
         """
+        if self.mysql_engine.dialect.name == 'sqlite':
+            create_floats_table_sql = create_floats_table_sql.replace("INT AUTO_INCREMENT PRIMARY KEY", "INTEGER PRIMARY KEY AUTOINCREMENT")
+            create_profiles_table_sql = create_profiles_table_sql.replace("INT AUTO_INCREMENT PRIMARY KEY", "INTEGER PRIMARY KEY AUTOINCREMENT")
         try:
             with self.mysql_engine.connect() as conn:
                 conn.execute(text(create_floats_table_sql))
                 conn.execute(text(create_profiles_table_sql))
+                self._add_missing_columns(conn)
+                self.summary_queue.create_table(conn)
                 conn.commit()
-            logging.info("MySQL tables 'argo_floats' and 'argo_profiles' are ready.")
+            logging.info("MySQL tables 'argo_floats', 'argo_profiles' and 'summary_queue' are ready.")
         except Exception as e:
             logging.error(f"Error creating MySQL tables: {e}")
             exit()
 
+    def _add_missing_columns(self, conn):
+        """
+        Brings argo_profiles tables created by older versions up to date.
+        """
+        inspector = inspect(conn)
+        columns = {c["name"] for c in inspector.get_columns("argo_profiles")}
+        if "data_mode" not in columns:
+            conn.execute(text("ALTER TABLE argo_profiles ADD COLUMN data_mode CHAR(1)"))
+            logging.info("Added 'data_mode' column to argo_profiles.")
+        if "updated_at" not in columns:
+            conn.execute(text("ALTER TABLE argo_profiles ADD COLUMN updated_at DATETIME"))
+            logging.info("Added 'updated_at' column to argo_profiles.")
+        # Lets the columnar store and the spatial index pick up rows changed in place
+        if "idx_argo_profiles_updated_at" not in {i["name"] for i in inspector.get_indexes("argo_profiles")}:
+            conn.execute(text("CREATE INDEX idx_argo_profiles_updated_at ON argo_profiles (updated_at)"))
+
+    def get_float_id(self, wmo_number):
+        """Returns a float's ID, or None if the float has not been loaded yet."""
+        with metrics.timer('mysql_read'), self.mysql_engine.connect() as conn:
+            return conn.execute(text("SELECT float_id FROM argo_floats WHERE wmo_number = :wmo"), {"wmo": wmo_number}).scalar()
+
     def get_or_create_float(self, wmo_number, project_name, platform_type):
         """
         Retrieves a float's ID from the database or creates a new entry.
         """
         with self.mysql_engine.connect() as conn:
-            result = conn.execute(text("SELECT float_id FROM argo_floats WHERE wmo_number = :wmo"), {"wmo": wmo_number}).fetchone()
+            with metrics.timer('mysql_read'):
+                result = conn.execute(text("SELECT float_id FROM argo_floats WHERE wmo_number = :wmo"), {"wmo": wmo_number}).fetchone()
             if result:
                 return result[0]
             else:
                 insert_sql = text("INSERT INTO argo_floats (wmo_number, project_name, platform_type) VALUES (:wmo, :proj, :platform)")
-                result = conn.execute(insert_sql, {"wmo": wmo_number, "proj": project_name, "platform": platform_type})
-                conn.commit()
+                with metrics.timer('mysql_write'):
+                    result = conn.execute(insert_sql, {"wmo": wmo_number, "proj": project_name, "platform": platform_type})
+                    conn.commit()
                 return result.lastrowid
 
     def check_profile_exists(self, float_id, cycle_number):
         """Checks if a specific profile already exists in the database."""
-        with self.mysql_engine.connect() as conn:
+        with metrics.timer('mysql_read'), self.mysql_engine.connect() as conn:
             result = conn.execute(text("SELECT 1 FROM argo_profiles WHERE float_id = :fid AND cycle_number = :cn"), {"fid": float_id, "cn": cycle_number}).fetchone()
             return result is not None
 
+    def get_existing_profiles(self, float_id):
+        """Returns {cycle_number: (profile_id, data_mode)} for the profiles already loaded for a float."""
+        with metrics.timer('mysql_read'), self.mysql_engine.connect() as conn:
+            rows = conn.execute(text("SELECT cycle_number, profile_id, data_mode FROM argo_profiles WHERE float_id = :fid"), {"fid": float_id}).fetchall()
+            return {row[0]: (row[1], row[2]) for row in rows}
+
     def insert_profile(self, profile_data):
         """Inserts a new profile into the MySQL database and returns its ID."""
-        logging.info("to sql .................")
         insert_sql = text("""
-            INSERT INTO argo_profiles (float_id, cycle_number, profile_time, latitude, longitude, pressure, temperature, salinity, bgc_params)
-            VALUES (:float_id, :cycle_number, :profile_time, :latitude, :longitude, :pressure, :temperature, :salinity, :bgc_params)
+            INSERT INTO argo_profiles (float_id, cycle_number, profile_time, latitude, longitude, pressure, temperature, salinity, bgc_params, data_mode, updated_at)
+            VALUES (:float_id, :cycle_number, :profile_time, :latitude, :longitude, :pressure, :temperature, :salinity, :bgc_params, :data_mode, :updated_at)
         """)
-        with self.mysql_engine.connect() as conn:
-            result = conn.execute(insert_sql, profile_data)
+        with metrics.timer('mysql_write'), self.mysql_engine.connect() as conn:
+            result = conn.execute(insert_sql, dict(profile_data, updated_at=datetime.utcnow()))
+            conn.commit()
+            profile_id = result.lastrowid
+        metrics.inc('argo_profiles_inserted_total', help_text="Profiles written to MySQL.")
+        self.spatial_index.add(profile_id, profile_data["latitude"], profile_data["longitude"], profile_data["profile_time"])
+        return profile_id
+
+    def update_profile(self, profile_id, profile_data):
+        """Replaces an existing profile's data in place (e.g. a delayed-mode file superseding real-time data)."""
+        update_sql = text("""
+            UPDATE argo_profiles
+            SET profile_time = :profile_time, latitude = :latitude, longitude = :longitude, pressure = :pressure,
+                temperature = :temperature, salinity = :salinity, bgc_params = :bgc_params, data_mode = :data_mode,
+                updated_at = :updated_at
+            WHERE profile_id = :profile_id
+        """)
+        with metrics.timer('mysql_write'), self.mysql_engine.connect() as conn:
+            conn.execute(update_sql, dict(profile_data, profile_id=profile_id, updated_at=datetime.utcnow()))
+            conn.commit()
+        metrics.inc('argo_profiles_updated_total', help_text="Profiles replaced by a newer data mode.")
+        self.spatial_index.add(profile_id, profile_data["latitude"], profile_data["longitude"], profile_data["profile_time"])
+        return profile_id
+
+    def set_data_mode(self, profile_id, data_mode):
+        """
+        Records a profile's data mode without touching its measurements, e.g. for rows loaded before
+        the column existed whose data turns out to be identical to the delayed-mode file.
+        """
+        with metrics.timer('mysql_write'), self.mysql_engine.connect() as conn:
+            conn.execute(text("UPDATE argo_profiles SET data_mode = :data_mode WHERE profile_id = :profile_id"),
+                         {"data_mode": data_mode, "profile_id": profile_id})
             conn.commit()
-            return result.lastrowid
+
+    def profile_matches(self, profile_id, profile_data):
+        """
+        True if the stored position, time and measurements equal those in profile_data (JSON-encoded like
+        insert_profile takes them), so replacing the row would not change anything worth re-summarizing.
+        """
+        stored = self.get_profile(profile_id)
+        if stored is None:
+            return False
+        if (abs(stored["latitude"] - profile_data["latitude"]) > 1e-4
+                or abs(stored["longitude"] - profile_data["longitude"]) > 1e-4
+                or abs((_as_datetime(stored["profile_time"]) - profile_data["profile_time"]).total_seconds()) >= 1):
+            return False
+        for column in ('pressure', 'temperature', 'salinity'):
+            new = json.loads(profile_data[column]) if profile_data[column] is not None else None
+            if not _same_values(stored[column], new):
+                return False
+        stored_bgc = stored["bgc_params"] or {}
+        new_bgc = json.loads(profile_data["bgc_params"]) if profile_data["bgc_params"] else {}
+        return stored_bgc.keys() == new_bgc.keys() and all(_same_values(stored_bgc[k], new_bgc[k]) for k in new_bgc)
+
+    def get_profile(self, profile_id):
+        """Returns one profile joined with its float's WMO number, with JSON columns decoded, or None."""
+        with metrics.timer('mysql_read'), self.mysql_engine.connect() as conn:
+            row = conn.execute(text("""
+                SELECT p.*, f.wmo_number FROM argo_profiles p
+                JOIN argo_floats f ON p.float_id = f.float_id
+                WHERE p.profile_id = :profile_id
+            """), {"profile_id": profile_id}).fetchone()
+        if row is None:
+            return None
+        profile = dict(row._mapping)
+        for column in ('pressure', 'temperature', 'salinity', 'bgc_params'):
+            if isinstance(profile[column], (str, bytes)):
+                profile[column] = json.loads(profile[column])
+        return profile
+
+    def enqueue_summaries(self, profile_ids):
+        """Queues profiles for LLM summarization and embedding by the summary workers."""
+        self.summary_queue.enqueue(profile_ids)
+        metrics.inc('argo_summaries_enqueued_total', len(profile_ids), help_text="Profiles queued for summarization.")
+
+    def find_nearest_profiles(self, lat, lon, k=5, start_time=None, end_time=None, return_distance=False):
+        """Returns the profile_ids of the k profiles nearest to (lat, lon), optionally within a time window."""
+        self.refresh_spatial_index()
+        return self.spatial_index.nearest(lat, lon, k=k, start_time=start_time, end_time=end_time,
+                                          return_distance=return_distance)
+
+    def find_profiles_within(self, lat, lon, radius_km, start_time=None, end_time=None, return_distance=False):
+        """Returns the profile_ids within radius_km of (lat, lon), optionally within a time window, nearest first."""
+        self.refresh_spatial_index()
+        return self.spatial_index.within(lat, lon, radius_km, start_time=start_time, end_time=end_time,
+                                         return_distance=return_distance)
 
     def add_profile_to_chromadb(self, profile_id_db, float_id_db, cycle, time, lat, lon, bgc_keys, pressure, temperature, salinity):
         """
-        Generates a summary, creates an embedding, and adds a profile to ChromaDB.
+        Generates a summary, creates an embedding, and adds (or replaces) a profile in ChromaDB.
         """
-        logging.info("ading profile to chroma.............")
-        url = "http://10.176.0.140:11434/api/generate"
+        url = f"{self.ollama_url}/api/generate"
 
         lmit_once = len(pressure)//2
 
         limit_arr = [0, lmit_once, -1]
         summary_text = ''
+        # Both requests together must finish well inside the summary queue lease
+        deadline = monotonic() + SUMMARY_REQUEST_TIMEOUT_SECONDS
 
 
         for i in range(2):
@@ -152,11 +344,10 @@ class DatabaseManager:
 i need the detailed explanation of the given data. use all the creativity and explain it as lengthy as possible
     """
         
-            print(prompt)
-            print("\n\n\n\n")
+            logging.debug(f"Summary prompt for profile {profile_id_db}:\n{prompt}")
             
             payload = {
-        "model": "llama3.1:8b",
+        "model": SUMMARY_MODEL,
         "prompt":prompt
     }
 
@@ -164,18 +355,27 @@ i need the detailed explanation of the given data. use all the creativity and ex
                 "Content-Type": "application/json"
             }
 
-            response = requests.post(url, data=json.dumps(payload), headers=headers, stream=True)
+            with metrics.timer('llm_summarize'), requests.post(
+                    url, data=json.dumps(payload), headers=headers, stream=True,
+                    timeout=(10, max(1.0, deadline - monotonic()))) as response:
+                response.raise_for_status()
 
-        
+                # Ollama streams output line by line (JSON objects)
+                for line in response.iter_lines():
+                    if monotonic() > deadline:
+                        raise TimeoutError(f"Ollama did not finish the summary within {SUMMARY_REQUEST_TIMEOUT_SECONDS}s")
+                    if line:
+                        data = json.loads(line.decode("utf-8"))
+                        if "error" in data:
+                            raise RuntimeError(f"Ollama returned an error: {data['error']}")
+                        if "response" in data:
+                            summary_text+=data["response"]
+                        if data.get("done", False):
+                            break
 
-            # Ollama streams output line by line (JSON objects)
-            for line in response.iter_lines():
-                if line:
-                    data = json.loads(line.decode("utf-8"))
-                    if "response" in data:
-                        summary_text+=data["response"]
-                    if data.get("done", False):
-                        break
+        # Never store an empty summary: failing here lets the summary queue retry with backoff
+        if not summary_text.strip():
+            raise ValueError(f"Ollama returned an empty summary for profile {profile_id_db}")
 
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=250,
@@ -184,19 +384,26 @@ i need the detailed explanation of the given data. use all the creativity and ex
         )
         chunks = text_splitter.split_text(summary_text)
 
-        print(f"Total chunks created: {len(chunks)}")
+        logging.debug(f"Total chunks created: {len(chunks)}")
         
-        embedding = self.embedding_model.encode(summary_text).tolist()
+        with metrics.timer('embedding'):
+            embedding = self.embedding_model.encode(summary_text).tolist()
         
-        self.chroma_collection.add(
-            ids=[f"profile_{profile_id_db}"],
-            embeddings=[embedding],
-            documents=[summary_text],
-            metadatas=[{
-                "profile_id_sql": profile_id_db,
-                "float_id_sql": float_id_db,
-                "latitude": lat,
-                "longitude": lon,
-                "date": time.strftime('%Y-%m-%d')
-            }]
-        )
\ No newline at end of file
+        with metrics.timer('chroma_write'):
+            self.chroma_collection.upsert(
+                ids=[f"profile_{profile_id_db}"],
+                embeddings=[embedding],
+                documents=[summary_text],
+                metadatas=[{
+                    "profile_id_sql": profile_id_db,
+                    "float_id_sql": float_id_db,
+                    "latitude": lat,
+                    "longitude": lon,
+                    "date": time.strftime('%Y-%m-%d'),
+                    # Numeric copies so ChromaDB can range-filter on them
+                    "date_num": date_number(time),
+                    "year": time.year,
+                    "month": time.month,
+                    "wmo_number": int(float_id_db)
+                }]
+            )
\ No newline at end of file
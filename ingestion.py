@@ -1,27 +1,42 @@
 import os
+import threading
 import werkzeug
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 from flask_restful import Resource, Api, reqparse
 from chromadb import PersistentClient
-client = PersistentClient(path="chroma_db_storage")
 from sentence_transformers import SentenceTransformer
+from metrics import metrics
+from chroma_reindex import active_collection_name
+from rag_service import InFlightCoalescer, normalize_question
 
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
-
-collection = client.get_or_create_collection(name="argo_float_profiles")
-
-
+CHROMA_PATH = "chroma_db_storage"
 NC_STORAGE_PATH = "data"
 
+# Opened on first use, so importing this module (e.g. from benchmark.py) touches neither the
+# production Chroma store nor the filesystem; callers may also assign their own model/collection
+model = None
+collection = None
+_search_lock = threading.Lock()
+
+def get_search_backend():
+    global model, collection
+    with _search_lock:
+        if model is None:
+            model = SentenceTransformer("all-MiniLM-L6-v2")
+        if collection is None:
+            client = PersistentClient(path=CHROMA_PATH)
+            collection = client.get_or_create_collection(name=active_collection_name(CHROMA_PATH))
+    return model, collection
+
+# Identical questions asked at the same time share one embedding and Chroma query
+question_coalescer = InFlightCoalescer('get_question')
+
 app = Flask(__name__)
 api = Api(app)
 CORS(app)
 
-# --- Ensure storage directory exists ---
-os.makedirs(NC_STORAGE_PATH, exist_ok=True)
-
 
 # In REST, a "Resource" is the core concept. Here, our resource is a NetCDF file.
 # This class will handle all requests related to the collection of files.
@@ -45,6 +60,9 @@ class NetCDFFileList(Resource):
         if not uploaded_files:
             return {'message': 'No files found in the request.'}, 400
 
+        # --- Ensure storage directory exists ---
+        os.makedirs(NC_STORAGE_PATH, exist_ok=True)
+
         results = []
         for file in uploaded_files:
             filename = werkzeug.utils.secure_filename(file.filename)
@@ -84,20 +102,42 @@ class NetCDFFileList(Resource):
 # POST requests to /files will be handled by the post() method in NetCDFFileList.
 api.add_resource(NetCDFFileList, '/files')
 
+def _search(user_query):
+    model, collection = get_search_backend()
+    with metrics.timer('embedding'):
+        query_embedding = model.encode([user_query]).tolist()
+
+    with metrics.timer('retrieval'):
+        return collection.query(
+            query_embeddings=query_embedding,
+            n_results=3
+        )
+
+
 @app.route('/get-question', methods=['POST'])
 def query():
     data = request.json
     user_query = data.get("prompt")
 
-    query_embedding = model.encode([user_query]).tolist()
-
-    results = collection.query(
-        query_embeddings=query_embedding,
-        n_results=3
-    )
+    metrics.inc('argo_http_requests_total', endpoint='/get-question', help_text="HTTP requests served.")
+    metrics.add_gauge('argo_http_in_flight', 1, endpoint='/get-question', help_text="HTTP requests in progress.")
+    try:
+        results = question_coalescer.run(normalize_question(user_query), lambda: _search(user_query))
+    finally:
+        metrics.add_gauge('argo_http_in_flight', -1, endpoint='/get-question')
 
     return jsonify({"response":f"{results['documents'][0][0]} \n\n {results['documents'][0][1]}"})
 
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Exposes this API process's timers, counters and queue depths in the Prometheus text format.
+    Ingest runs (main.py), summary workers and the Streamlit chat (app.py) serve their own on
+    INGEST_METRICS_PORT, SUMMARY_METRICS_PORT and RAG_METRICS_PORT.
+    """
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000, host = "0.0.0.0")
\ No newline at end of file
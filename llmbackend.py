@@ -1,10 +1,21 @@
-import json
 import logging
+from datetime import datetime
 import ollama
 import streamlit as st
 from sqlalchemy import text
 
 from database_manager import DatabaseManager
+from metrics import metrics
+from query_constraints import extract_constraints
+from context_builder import ContextBuilder
+from config import CONTEXT_TOKEN_BUDGET, GENERATION_KEEP_ALIVE
+
+# How many spatially nearest profiles the vector search is restricted to
+SPATIAL_CANDIDATES = 50
+
+# Results requested from ChromaDB with and without metadata constraints
+N_RESULTS = 5
+FILTERED_N_RESULTS = 3
 
 class ArgoRAG:
     """
@@ -12,6 +23,7 @@ class ArgoRAG:
     """
     def __init__(self, db_manager: DatabaseManager):
         self.db_manager = db_manager
+        self.context_builder = ContextBuilder(token_budget=CONTEXT_TOKEN_BUDGET)
         self._check_ollama_setup()
 
     def _check_ollama_setup(self):
@@ -40,30 +52,49 @@ class ArgoRAG:
         """
         Answers a user's question by performing a RAG pipeline with a local LLM.
         """
+        context_data, message = self.retrieve(question)
+        if message is not None:
+            return message, context_data
+        return self.generate(question, context_data), context_data
+
+    def retrieve(self, question: str):
+        """
+        Runs the retrieval half of the pipeline (embedding, ChromaDB search, MySQL fetch).
+        Returns (context_data, message); message is a ready answer when the pipeline stops early, otherwise None.
+        """
         logging.info(f"Received question: {question}")
 
-        # 1. Retrieve relevant documents from ChromaDB
+        # 1. Retrieve relevant documents from ChromaDB, pre-filtered by the time/location constraints in the question
         try:
-            query_embedding = self.db_manager.embedding_model.encode(question).tolist()
-            search_results = self.db_manager.chroma_collection.query(
-                query_embeddings=[query_embedding], n_results=5
-            )
+            where = self._constraint_filter(question)
+            query_kwargs = {"where": where} if where else {}
+            n_results = FILTERED_N_RESULTS if where else N_RESULTS
+
+            with metrics.timer('embedding'):
+                query_embedding = self.db_manager.embedding_model.encode(question).tolist()
+            with metrics.timer('retrieval'):
+                search_results = self.db_manager.chroma_collection.query(
+                    query_embeddings=[query_embedding], n_results=n_results, **query_kwargs
+                )
             logging.info(f"Found {len(search_results['ids'][0])} relevant profiles from ChromaDB.")
+            if where and not search_results['ids'][0]:
+                self._warn_if_metadata_missing()
+                return [], "I couldn't find any ARGO profiles matching the dates, region or floats in your question."
         except Exception as e:
             logging.error(f"Error querying ChromaDB: {e}")
-            return "Sorry, I couldn't search for relevant data in the vector database.", []
+            return [], "Sorry, I couldn't search for relevant data in the vector database."
 
         if not search_results or not search_results['ids'][0]:
-            return "I couldn't find any ARGO profiles relevant to your question.", []
+            return [], "I couldn't find any ARGO profiles relevant to your question."
 
         # 2. Fetch full data from MySQL using SQLAlchemy Engine
         profile_sql_ids = [meta['profile_id_sql'] for meta in search_results['metadatas'][0]]
         context_data = []
         try:
-            with self.db_manager.mysql_engine.connect() as conn:
+            with metrics.timer('mysql_read'), self.db_manager.mysql_engine.connect() as conn:
                 for profile_id in profile_sql_ids:
                     query = text(f"""
-                        SELECT p.profile_time, p.latitude, p.longitude, p.temperature, p.salinity, f.wmo_number
+                        SELECT p.profile_time, p.latitude, p.longitude, p.pressure, p.temperature, p.salinity, f.wmo_number
                         FROM argo_profiles p
                         JOIN argo_floats f ON p.float_id = f.float_id
                         WHERE p.profile_id = :profile_id
@@ -75,42 +106,58 @@ class ArgoRAG:
             logging.info(f"Successfully fetched details for {len(context_data)} profiles from MySQL.")
         except Exception as e:
             logging.error(f"Error fetching data from MySQL: {e}")
-            return "Sorry, I failed to retrieve the full data for the relevant profiles.", []
+            return [], "Sorry, I failed to retrieve the full data for the relevant profiles."
+        return context_data, None
 
+    def generate(self, question: str, context_data: list):
+        """
+        Runs the generation half of the pipeline: builds the prompt and asks the local LLM.
+        """
         # 3. Generate a response using the local LLM
-        prompt = self._build_prompt(question, context_data)
+        prompt, prompt_stats = self.context_builder.build(question, context_data)
         try:
-            response = ollama.generate(model='phi3', prompt=prompt, stream=False)
-            logging.info("Successfully generated a response from Phi-3.")
-            return response['response'], context_data
+            with metrics.timer('generation'):
+                response = ollama.generate(model='phi3', prompt=prompt, stream=False, keep_alive=GENERATION_KEEP_ALIVE)
+            prompt_tokens = response.get('prompt_eval_count') or prompt_stats["estimated_prompt_tokens"]
+            metrics.inc('argo_prompt_tokens_total', prompt_tokens, help_text="Prompt tokens sent to the generation model.")
+            logging.info(f"Successfully generated a response from Phi-3 ({prompt_tokens} prompt tokens, "
+                         f"{prompt_stats['profiles_included']}/{prompt_stats['profiles_available']} profiles in context).")
+            return response['response']
         except Exception as e:
             logging.error(f"Error communicating with Ollama: {e}")
-            return "Sorry, I am having trouble connecting to the local Ollama service.", context_data
+            return "Sorry, I am having trouble connecting to the local Ollama service."
 
-    def _build_prompt(self, question: str, context_data: list) -> str:
+    def _warn_if_metadata_missing(self):
         """
-        Builds a detailed prompt for the local LLM.
+        Entries written before the date/WMO metadata existed never match a filter; points at the backfill
+        instead of answering from unrelated dates and regions.
         """
-        context_str = "Here is some relevant oceanographic data from ARGO floats:\n\n"
-        for i, item in enumerate(context_data, 1):
-            temp_preview = json.loads(item['temperature'])[:5] if item.get('temperature') else 'N/A'
-            sal_preview = json.loads(item['salinity'])[:5] if item.get('salinity') else 'N/A'
-            context_str += f"--- Data Point {i} ---\n"
-            context_str += f"Float WMO Number: {item.get('wmo_number', 'N/A')}\n"
-            context_str += f"Date: {item.get('profile_time').strftime('%Y-%m-%d') if item.get('profile_time') else 'N/A'}\n"
-            context_str += f"Location: {item.get('latitude', 0.0):.2f}, {item.get('longitude', 0.0):.2f}\n"
-            context_str += f"Temperature readings (first 5): {temp_preview}\n"
-            context_str += f"Salinity readings (first 5): {sal_preview}\n\n"
-
-        prompt = f"""
-        You are an expert oceanographic data analyst. Answer the user's question based *only* on the provided ARGO float data.
-        If the context is insufficient, state that you cannot answer from the given data. Do not use external knowledge. Be concise.
-
-        Context:
-        {context_str}
-
-        Question: "{question}"
-
-        Answer:
+        if not self.db_manager.chroma_collection.get(where={"date_num": {"$gte": 0}}, limit=1, include=[])['ids']:
+            logging.warning("No ChromaDB entry has date metadata, so filtered searches cannot match; "
+                            "run `python chroma_reindex.py --backfill-metadata`.")
+
+    def _constraint_filter(self, question: str):
         """
-        return prompt
\ No newline at end of file
+        Turns dates, regions, positions and WMO numbers in the question into a ChromaDB `where` filter.
+        A position is resolved to its nearest profiles with the spatial index.
+        """
+        constraints = extract_constraints(question)
+        if not constraints:
+            return None
+        logging.info(f"Parsed question constraints: {constraints}")
+
+        profile_ids = None
+        if constraints.position:
+            start = datetime.combine(constraints.start_date, datetime.min.time()) if constraints.start_date else None
+            end = datetime.combine(constraints.end_date, datetime.max.time()) if constraints.end_date else None
+            if constraints.radius_km:
+                profile_ids = self.db_manager.find_profiles_within(
+                    *constraints.position, constraints.radius_km, start_time=start, end_time=end)[:SPATIAL_CANDIDATES]
+            else:
+                profile_ids = self.db_manager.find_nearest_profiles(
+                    *constraints.position, k=SPATIAL_CANDIDATES, start_time=start, end_time=end)
+            logging.info(f"Restricting search to {len(profile_ids)} profiles near {constraints.position}.")
+            if not profile_ids:
+                # Nothing nearby in the window: a filter that matches nothing, rather than the whole ocean
+                profile_ids = [-1]
+        return constraints.to_chroma_where(profile_ids)
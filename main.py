@@ -3,9 +3,11 @@ import logging
 import warnings
 
 # Import configurations and classes from other files
-from config import ARGO_DATA_DIR, DB_USER, DB_PASSWORD
+from config import ARGO_DATA_DIR, DB_USER, DB_PASSWORD, SUMMARIZE_AFTER_INGEST, SUMMARY_WORKERS, INGEST_METRICS_PORT
 from database_manager import DatabaseManager
 from data_processor import ArgoDataProcessor
+from metrics import metrics, start_metrics_server
+from summary_queue import reconcile, run_workers
 
 def main():
     """
@@ -30,6 +32,10 @@ def main():
         logging.error("Please update the DB_USER and DB_PASSWORD variables in 'config.py'.")
         return
         
+    # Stage timings and queue depths of this run, scrapeable while it is in progress
+    if INGEST_METRICS_PORT:
+        start_metrics_server(INGEST_METRICS_PORT)
+
     # --- Pipeline Execution ---
     try:
         # 1. Initialize the manager for database operations
@@ -41,14 +47,25 @@ def main():
         # 3. Initialize the processor with the database manager
         processor = ArgoDataProcessor(db_manager)
         
-        # 4. Start the ingestion process
+        # 4. Start the ingestion process (MySQL only; profiles are queued for summarization)
         processor.process_and_ingest()
+
+        # 5. Queue anything in MySQL still missing from ChromaDB, then summarize and embed the queue
+        reconcile(db_manager, db_manager.summary_queue)
+        if SUMMARIZE_AFTER_INGEST:
+            processed = run_workers(db_manager, db_manager.summary_queue, workers=SUMMARY_WORKERS, drain=True)
+            logging.info(f"Summarized and embedded {processed} profiles.")
+        logging.info(f"Summary queue: {db_manager.summary_queue.counts()}")
         
         logging.info("ARGO Data Ingestion Pipeline finished successfully.")
 
     except Exception as e:
         logging.error(f"An unexpected error occurred during the pipeline execution: {e}", exc_info=True)
 
+    finally:
+        # Per-stage timings, slowest first, to show where the run spent its time
+        metrics.log_summary()
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
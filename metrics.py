@@ -0,0 +1,225 @@
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket upper bounds in seconds, from sub-millisecond DB reads to multi-minute LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+STAGE_HISTOGRAM = 'argo_stage_duration_seconds'
+STAGE_ERRORS = 'argo_stage_errors_total'
+QUEUE_DEPTH = 'argo_queue_depth'
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bucket bound containing the q-th observation (what Prometheus' histogram_quantile approximates)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters, gauges and histograms rendered in the Prometheus text format.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._types = {}
+        self._help = {}
+        self._values = {}
+
+    def _register(self, name, kind, help_text):
+        known = self._types.setdefault(name, kind)
+        if known != kind:
+            raise ValueError(f"Metric '{name}' is already registered as a {known}")
+        if help_text:
+            self._help.setdefault(name, help_text)
+        return self._values.setdefault(name, {})
+
+    def inc(self, name, value=1, help_text='', **labels):
+        with self._lock:
+            series = self._register(name, 'counter', help_text)
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name, value, help_text='', **labels):
+        with self._lock:
+            self._register(name, 'gauge', help_text)[_label_key(labels)] = value
+
+    def add_gauge(self, name, delta, help_text='', **labels):
+        with self._lock:
+            series = self._register(name, 'gauge', help_text)
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + delta
+
+    def observe(self, name, value, help_text='', **labels):
+        with self._lock:
+            series = self._register(name, 'histogram', help_text)
+            key = _label_key(labels)
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram(self.buckets)
+            hist.observe(value)
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        """
+        Times a pipeline stage into argo_stage_duration_seconds{stage=...}; failures are also counted.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(STAGE_ERRORS, stage=stage, help_text="Pipeline stage failures.", **labels)
+            raise
+        finally:
+            self.observe(STAGE_HISTOGRAM, time.perf_counter() - start, stage=stage,
+                         help_text="Time spent per pipeline stage.", **labels)
+
+    def set_queue_depth(self, queue, depth):
+        self.set_gauge(QUEUE_DEPTH, depth, queue=queue, help_text="Items waiting in a pipeline queue.")
+
+    def add_queue_depth(self, queue, delta):
+        self.add_gauge(QUEUE_DEPTH, delta, queue=queue, help_text="Items waiting in a pipeline queue.")
+
+    def render_prometheus(self):
+        """
+        Returns all metrics in the Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        with self._lock:
+            for name in sorted(self._values):
+                kind = self._types[name]
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in sorted(self._values[name].items()):
+                    if kind != 'histogram':
+                        lines.append(f"{name}{_format_labels(key)} {value}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(value.buckets, value.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', repr(bound))])} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {value.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {value.sum}")
+                    lines.append(f"{name}_count{_format_labels(key)} {value.count}")
+        return '\n'.join(lines) + '\n'
+
+    def stage_summary(self):
+        """
+        Returns {stage: {count, total_s, mean_ms, p95_ms, max_ms, errors}} for all timed stages.
+        """
+        summary = {}
+        with self._lock:
+            errors = {dict(k).get('stage'): v for k, v in self._values.get(STAGE_ERRORS, {}).items()}
+            for key, hist in self._values.get(STAGE_HISTOGRAM, {}).items():
+                stage = dict(key).get('stage')
+                summary[stage] = {
+                    "count": hist.count,
+                    "total_s": round(hist.sum, 3),
+                    "mean_ms": round(1000.0 * hist.sum / hist.count, 2) if hist.count else 0.0,
+                    "p95_ms": round(1000.0 * hist.quantile(0.95), 2),
+                    "max_ms": round(1000.0 * hist.max, 2),
+                    "errors": errors.get(stage, 0),
+                }
+        return summary
+
+    def log_summary(self):
+        """
+        Logs one line per stage, slowest total first, so the saturated stage is at the top.
+        """
+        summary = self.stage_summary()
+        if not summary:
+            return
+        logging.info("Pipeline stage timings:")
+        for stage, s in sorted(summary.items(), key=lambda item: item[1]["total_s"], reverse=True):
+            logging.info(f"  {stage:<16} count={s['count']:<7} total={s['total_s']:>9.3f}s mean={s['mean_ms']:>9.2f}ms "
+                         f"p95<={s['p95_ms']:>9.2f}ms max={s['max_ms']:>9.2f}ms errors={s['errors']}")
+
+
+# Process-wide registry shared by the ingest pipeline, the RAG backend and the Flask app
+metrics = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = metrics
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        payload = self.registry.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_metrics_server(port, host='0.0.0.0', registry=metrics):
+    """
+    Serves the registry at http://host:port/metrics from a daemon thread, for processes other than the
+    Flask app (main.py ingest runs, summary workers). Returns the server, or None if the port is taken.
+    """
+    handler = type('RegistryMetricsHandler', (_MetricsHandler,), {'registry': registry})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        logging.warning(f"Could not serve metrics on port {port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def log_summary_periodically(interval_s, stop_event, registry=metrics):
+    """
+    Logs the stage summary every interval_s seconds from a daemon thread until stop_event is set,
+    so long-running workers show their saturated stage without being stopped.
+    """
+    def loop():
+        while not stop_event.wait(interval_s):
+            registry.log_summary()
+    thread = threading.Thread(target=loop, name='metrics-logger', daemon=True)
+    thread.start()
+    return thread
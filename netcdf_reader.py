@@ -0,0 +1,104 @@
+import numpy as np
+import netCDF4
+from datetime import datetime, timedelta
+
+from metrics import metrics
+
+CORE_VARIABLES = {'pressure': 'PRES', 'temperature': 'TEMP', 'salinity': 'PSAL'}
+BGC_VARIABLES = ['DOXY', 'CHLA', 'BBP700', 'NITRATE']
+
+# JULD is days since 1950-01-01
+JULD_EPOCH = datetime(1950, 1, 1)
+
+
+def _strings(var):
+    """Reads a char variable (N_PROF, STRINGn) or (N_PROF,) into a list of stripped str."""
+    raw = np.ma.filled(var[:], b' ')
+    if raw.dtype.kind == 'S' and raw.dtype.itemsize == 1 and raw.ndim > 1:
+        raw = netCDF4.chartostring(raw)
+    return [(v.decode('latin-1') if isinstance(v, bytes) else str(v)).strip() for v in np.atleast_1d(raw)]
+
+
+def _floats(var):
+    """
+    Reads a numeric variable with fill values replaced by NaN, keeping the on-disk float32 precision.
+    Only _FillValue/missing_value are masked, like xarray's CF decoding; values outside valid_min/valid_max
+    are kept, so both readers ingest the same numbers.
+    """
+    data = np.asarray(var[:])
+    dtype = np.float32 if data.dtype == np.float32 else np.float64
+    missing = np.zeros(data.shape, dtype=bool)
+    for attr in ('_FillValue', 'missing_value'):
+        if attr in var.ncattrs():
+            missing |= np.isin(data, np.atleast_1d(var.getncattr(attr)))
+    values = data.astype(dtype)
+    if 'scale_factor' in var.ncattrs():
+        values = values * var.getncattr('scale_factor')
+    if 'add_offset' in var.ncattrs():
+        values = values + var.getncattr('add_offset')
+    values = values.astype(dtype, copy=False)
+    values[missing] = np.nan
+    return values
+
+
+def to_json_list(values):
+    """Converts a 1-D float array to a list of Python floats with None for missing values."""
+    out = values.astype(np.float64).astype(object)
+    out[np.isnan(values)] = None
+    return out.tolist()
+
+
+def read_argo_file(path):
+    """
+    Reads an ARGO profile file with netCDF4 directly, touching only the variables the ingest needs.
+
+    Returns (float_info, profiles): float_info has wmo_number/project_name/platform_type, and each
+    profile is a dict with cycle_number, data_mode, profile_time, latitude, longitude,
+    pressure/temperature/salinity lists and a bgc_params dict. Raises on layouts it does not understand,
+    so callers can fall back to xarray.
+    """
+    with metrics.timer('file_open'):
+        ds = netCDF4.Dataset(path, 'r')
+    with ds, metrics.timer('extraction'):
+        ds.set_auto_chartostring(False)
+        # Masking and scaling are done in _floats, which ignores valid_min/valid_max like xarray does
+        ds.set_auto_maskandscale(False)
+        variables = ds.variables
+
+        platform_numbers = _strings(variables['PLATFORM_NUMBER'])
+        float_info = {
+            "wmo_number": int(platform_numbers[0]),
+            "project_name": getattr(ds, 'project_name', 'N/A'),
+            "platform_type": getattr(ds, 'platform_type', 'N/A'),
+        }
+
+        n_prof = len(ds.dimensions['N_PROF'])
+        cycles = np.nan_to_num(_floats(variables['CYCLE_NUMBER']), nan=-1).astype(np.int64).reshape(n_prof)
+        juld = _floats(variables['JULD']).reshape(n_prof)
+        lat = _floats(variables['LATITUDE']).reshape(n_prof)
+        lon = _floats(variables['LONGITUDE']).reshape(n_prof)
+        data_modes = _strings(variables['DATA_MODE']) if 'DATA_MODE' in variables else [''] * n_prof
+        if len(data_modes) == 1 and n_prof > 1:
+            # Some files store DATA_MODE as one char string of length N_PROF
+            data_modes = list(data_modes[0].ljust(n_prof))
+
+        measurements = {name: _floats(variables[var]).reshape(n_prof, -1)
+                        for name, var in CORE_VARIABLES.items() if var in variables}
+        bgc = {var: _floats(variables[var]).reshape(n_prof, -1) for var in BGC_VARIABLES if var in variables}
+
+    profiles = []
+    for i in range(n_prof):
+        if np.isnan(juld[i]) or np.isnan(lat[i]) or np.isnan(lon[i]):
+            raise ValueError(f"Profile {i} has no valid date or position")
+        profile = {
+            "cycle_number": int(cycles[i]),
+            "data_mode": data_modes[i] if i < len(data_modes) else '',
+            "profile_time": JULD_EPOCH + timedelta(days=float(juld[i])),
+            "latitude": float(lat[i]),
+            "longitude": float(lon[i]),
+            "bgc_params": {var: to_json_list(values[i]) for var, values in bgc.items()},
+        }
+        for name in CORE_VARIABLES:
+            profile[name] = to_json_list(measurements[name][i]) if name in measurements else None
+        profiles.append(profile)
+    return float_info, profiles
@@ -0,0 +1,206 @@
+import re
+import calendar
+from datetime import date
+
+MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+MONTHS['sept'] = 9
+MONTH_NAMES = '|'.join(sorted(MONTHS, key=len, reverse=True))
+
+# Named regions as (lat_min, lat_max, lon_min, lon_max); more specific names are matched first
+REGIONS = {
+    'equatorial indian ocean': (-5.0, 5.0, 40.0, 100.0),
+    'arabian sea': (5.0, 25.0, 50.0, 78.0),
+    'bay of bengal': (5.0, 23.0, 80.0, 95.0),
+    'andaman sea': (5.0, 20.0, 92.0, 99.0),
+    'laccadive sea': (0.0, 14.0, 70.0, 78.0),
+    'red sea': (12.0, 30.0, 32.0, 44.0),
+    'persian gulf': (23.0, 31.0, 47.0, 57.0),
+    'gulf of aden': (10.0, 16.0, 43.0, 52.0),
+    'mozambique channel': (-27.0, -10.0, 33.0, 50.0),
+    'southern ocean': (-90.0, -45.0, -180.0, 180.0),
+    'indian ocean': (-45.0, 30.0, 20.0, 120.0),
+    'equator': (-5.0, 5.0, -180.0, 180.0),
+    'tropics': (-23.5, 23.5, -180.0, 180.0),
+}
+REGION_PATTERN = re.compile(r'\b(' + '|'.join(re.escape(r) for r in REGIONS) + r')\b', re.IGNORECASE)
+
+# A single position such as "10°N 75°E", "10.5 N, 75 E" or "12S 45W"
+POSITION_PATTERN = re.compile(
+    r"(\d{1,2}(?:\.\d+)?)\s*°?\s*([NS])\b[\s,]*(\d{1,3}(?:\.\d+)?)\s*°?\s*([EW])\b", re.IGNORECASE
+)
+# Latitude/longitude bands such as "between 10N and 20N" or "from 60°E to 80°E"
+BAND_PATTERN = re.compile(
+    r"(?:between|from)\s+(\d{1,3}(?:\.\d+)?)\s*°?\s*([NSEW])\b\s*(?:and|to|-)\s*(\d{1,3}(?:\.\d+)?)\s*°?\s*([NSEW])\b",
+    re.IGNORECASE,
+)
+RADIUS_PATTERN = re.compile(r"within\s+(\d+(?:\.\d+)?)\s*(km|kilometers|kilometres|nm|nautical miles)", re.IGNORECASE)
+
+# Numbers like 2000 are usually depths in ARGO questions ("at 2000 dbar", "from 1000 to 2000 m"), so a
+# bare number only counts as a year right after a time word and never when a depth unit follows it
+NOT_DEPTH = r"(?!\s*(?:m|dbar|db|decibars?|meters?|metres?)\b)"
+ISO_DATE_PATTERN = re.compile(r"\b((?:19|20)\d{2})-(\d{2})-(\d{2})\b")
+MONTH_YEAR_PATTERN = re.compile(rf"\b({MONTH_NAMES})\.?,?\s+((?:19|20)\d{{2}})\b{NOT_DEPTH}", re.IGNORECASE)
+MONTH_PATTERN = re.compile(rf"\b(?:in|during|of)\s+({MONTH_NAMES})\b", re.IGNORECASE)
+YEAR_RANGE_PATTERN = re.compile(
+    rf"\b(?:between|from)\s+((?:19|20)\d{{2}})\b{NOT_DEPTH}\s*(?:and|to|-)\s*((?:19|20)\d{{2}})\b{NOT_DEPTH}", re.IGNORECASE
+)
+YEAR_BOUND_PATTERN = re.compile(rf"\b(since|after|before|until)\s+((?:19|20)\d{{2}})\b{NOT_DEPTH}", re.IGNORECASE)
+YEAR_PATTERN = re.compile(rf"\b(?:in|during|of|since|year|years)\s+((?:19|20)\d{{2}})\b{NOT_DEPTH}", re.IGNORECASE)
+WMO_PATTERN = re.compile(r"\b([1-7]\d{6})\b")
+
+
+def date_number(d):
+    """Encodes a date as the integer YYYYMMDD stored in the 'date_num' metadata field."""
+    return d.year * 10000 + d.month * 100 + d.day
+
+
+def _signed(value, hemisphere):
+    value = float(value)
+    return -value if hemisphere.upper() in ('S', 'W') else value
+
+
+class QueryConstraints:
+    """
+    Time, location and float constraints parsed from a natural-language question.
+    """
+    def __init__(self):
+        self.date_min = None     # YYYYMMDD ints, inclusive
+        self.date_max = None
+        self.months = None       # month numbers when no year is given, e.g. "in March"
+        self.lat_range = None    # (min, max)
+        self.lon_range = None    # (min, max); min > max means the range crosses 180°
+        self.position = None     # (lat, lon) for nearest-profile searches
+        self.radius_km = None
+        self.wmo_numbers = []
+        self.region = None
+
+    def __bool__(self):
+        return any(v is not None for v in (self.date_min, self.date_max, self.months, self.lat_range,
+                                           self.lon_range, self.position)) or bool(self.wmo_numbers)
+
+    def __repr__(self):
+        fields = {k: v for k, v in vars(self).items() if v not in (None, [])}
+        return f"QueryConstraints({fields})"
+
+    @property
+    def start_date(self):
+        return None if self.date_min is None else date(self.date_min // 10000, self.date_min // 100 % 100, self.date_min % 100)
+
+    @property
+    def end_date(self):
+        return None if self.date_max is None else date(self.date_max // 10000, self.date_max // 100 % 100, self.date_max % 100)
+
+    def to_chroma_where(self, profile_ids=None):
+        """
+        Builds a Chroma `where` filter, or None when there is nothing to filter on.
+        profile_ids (e.g. from the spatial index) replace the lat/lon box when given.
+        """
+        clauses = []
+        if self.date_min is not None:
+            clauses.append({"date_num": {"$gte": self.date_min}})
+        if self.date_max is not None:
+            clauses.append({"date_num": {"$lte": self.date_max}})
+        if self.months:
+            clauses.append({"month": {"$in": list(self.months)}})
+        if profile_ids is not None:
+            clauses.append({"profile_id_sql": {"$in": list(profile_ids)}})
+        else:
+            if self.lat_range:
+                clauses.append({"latitude": {"$gte": self.lat_range[0]}})
+                clauses.append({"latitude": {"$lte": self.lat_range[1]}})
+            if self.lon_range and self.lon_range != (-180.0, 180.0):
+                lon_min, lon_max = self.lon_range
+                if lon_min <= lon_max:
+                    clauses.append({"longitude": {"$gte": lon_min}})
+                    clauses.append({"longitude": {"$lte": lon_max}})
+                else:
+                    clauses.append({"$or": [{"longitude": {"$gte": lon_min}}, {"longitude": {"$lte": lon_max}}]})
+        if self.wmo_numbers:
+            clauses.append({"wmo_number": {"$in": list(self.wmo_numbers)}})
+
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def extract_constraints(question: str) -> QueryConstraints:
+    """
+    Parses dates, months, years, lat/lon bands, positions, named regions and WMO numbers from a question.
+    """
+    c = QueryConstraints()
+
+    # --- Floats: 7-digit WMO numbers (checked before years so they are not mistaken for one) ---
+    c.wmo_numbers = sorted({int(m) for m in WMO_PATTERN.findall(question)})
+    text = WMO_PATTERN.sub(' ', question)
+
+    # --- Time ---
+    iso_dates = []
+    for y, m, d in ISO_DATE_PATTERN.findall(text):
+        try:
+            iso_dates.append(date(int(y), int(m), int(d)))
+        except ValueError:
+            # e.g. 2023-02-30: ignore it rather than failing the whole search
+            pass
+    month_years = [(int(y), MONTHS[m.lower()]) for m, y in MONTH_YEAR_PATTERN.findall(text)]
+    year_range = YEAR_RANGE_PATTERN.search(text)
+    year_bounds = YEAR_BOUND_PATTERN.findall(text)
+    if iso_dates:
+        c.date_min, c.date_max = date_number(min(iso_dates)), date_number(max(iso_dates))
+    elif month_years:
+        (y0, m0), (y1, m1) = min(month_years), max(month_years)
+        c.date_min = date_number(date(y0, m0, 1))
+        c.date_max = date_number(date(y1, m1, calendar.monthrange(y1, m1)[1]))
+    elif year_range:
+        y0, y1 = sorted((int(year_range.group(1)), int(year_range.group(2))))
+        c.date_min, c.date_max = y0 * 10000 + 101, y1 * 10000 + 1231
+    elif year_bounds:
+        for word, year in year_bounds:
+            year = int(year)
+            if word.lower() == 'since':
+                c.date_min = year * 10000 + 101
+            elif word.lower() == 'after':
+                c.date_min = (year + 1) * 10000 + 101
+            elif word.lower() == 'before':
+                c.date_max = (year - 1) * 10000 + 1231
+            else:
+                c.date_max = year * 10000 + 1231
+    else:
+        years = sorted({int(y) for y in YEAR_PATTERN.findall(text)})
+        if years:
+            c.date_min, c.date_max = years[0] * 10000 + 101, years[-1] * 10000 + 1231
+        months = sorted({MONTHS[m.lower()] for m in MONTH_PATTERN.findall(text)})
+        if months and not years:
+            c.months = months
+        elif months:
+            # "in March ... 2023" without them being adjacent: narrow the year range to those months
+            c.date_min = years[0] * 10000 + months[0] * 100 + 1
+            c.date_max = years[-1] * 10000 + months[-1] * 100 + calendar.monthrange(years[-1], months[-1])[1]
+
+    # --- Location ---
+    for lo, lo_hemi, hi, hi_hemi in BAND_PATTERN.findall(text):
+        a, b = _signed(lo, lo_hemi), _signed(hi, hi_hemi)
+        if lo_hemi.upper() in 'NS' and hi_hemi.upper() in 'NS':
+            c.lat_range = (min(a, b), max(a, b))
+        elif lo_hemi.upper() in 'EW' and hi_hemi.upper() in 'EW':
+            c.lon_range = (a, b)
+    text = BAND_PATTERN.sub(' ', text)
+
+    position = POSITION_PATTERN.search(text)
+    if position:
+        lat = _signed(position.group(1), position.group(2))
+        lon = _signed(position.group(3), position.group(4))
+        if abs(lat) <= 90 and abs(lon) <= 180:
+            c.position = (lat, lon)
+            radius = RADIUS_PATTERN.search(text)
+            if radius:
+                value = float(radius.group(1))
+                c.radius_km = value * 1.852 if radius.group(2).lower().startswith('n') else value
+
+    region = REGION_PATTERN.search(text)
+    if region and not (c.lat_range or c.lon_range or c.position):
+        c.region = region.group(1).lower()
+        lat_min, lat_max, lon_min, lon_max = REGIONS[c.region]
+        c.lat_range, c.lon_range = (lat_min, lat_max), (lon_min, lon_max)
+
+    return c
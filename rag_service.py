@@ -0,0 +1,153 @@
+import time
+import queue
+import logging
+import itertools
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from config import RAG_GENERATION_WORKERS, RAG_MAX_QUEUED_GENERATIONS, RAG_REQUEST_TIMEOUT_SECONDS
+from metrics import metrics, STAGE_HISTOGRAM
+
+# Lower values are served first; interactive chat goes ahead of scripted/API callers
+PRIORITY_INTERACTIVE = 0
+PRIORITY_API = 10
+
+BUSY_MESSAGE = "The assistant is busy answering other questions right now. Please try again in a moment."
+
+
+def normalize_question(question: str):
+    """Key under which identical questions are coalesced: case, whitespace and trailing punctuation are ignored."""
+    return " ".join(question.lower().split()).rstrip("?.! ")
+
+
+class ServiceBusy(Exception):
+    """Raised when a request is shed because the generation queue is full or its deadline has passed."""
+
+
+class InFlightCoalescer:
+    """
+    Runs one computation per key at a time; callers arriving while it runs wait for and share its result.
+    Nothing is cached once the computation finishes.
+    """
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def run(self, key, fn, timeout=None):
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+
+        if not leader:
+            metrics.inc('argo_coalesced_requests_total', coalescer=self.name,
+                        help_text="Requests answered by an identical request already in flight.")
+            return future.result(timeout)
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+
+class _GenerationJob:
+    def __init__(self, question, context_data, deadline):
+        self.question = question
+        self.context_data = context_data
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.future = Future()
+
+
+class RAGService:
+    """
+    Serves ArgoRAG answers to concurrent callers without overloading Ollama.
+    Identical questions in flight share one pipeline run, and generations go through a bounded
+    priority queue drained by a fixed number of workers; requests that cannot be served in time are shed.
+    """
+    def __init__(self, rag, generation_workers=RAG_GENERATION_WORKERS, max_queued=RAG_MAX_QUEUED_GENERATIONS,
+                 timeout=RAG_REQUEST_TIMEOUT_SECONDS):
+        self.rag = rag
+        self.timeout = timeout
+        self.coalescer = InFlightCoalescer('rag_answer')
+        self._queue = queue.PriorityQueue(maxsize=max_queued)
+        self._sequence = itertools.count()
+        self._workers = [
+            threading.Thread(target=self._work, name=f"rag-generation-{i}", daemon=True)
+            for i in range(generation_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        logging.info(f"RAG service started with {generation_workers} generation workers and room for {max_queued} queued requests.")
+
+    def ask(self, question: str, priority=PRIORITY_API, timeout=None):
+        """
+        Answers a question like ArgoRAG.answer_question, returning (response, context_data).
+        Callers are scripted/API traffic unless they pass PRIORITY_INTERACTIVE, as the chat UI does.
+        Returns BUSY_MESSAGE instead of waiting longer than the timeout.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        metrics.add_gauge('argo_rag_in_flight', 1, help_text="RAG questions being answered.")
+        try:
+            with metrics.timer('rag_request'):
+                return self.coalescer.run(normalize_question(question),
+                                          lambda: self._answer(question, priority, deadline), timeout=timeout)
+        except ServiceBusy as e:
+            logging.warning(f"Shed RAG request: {e}")
+            return BUSY_MESSAGE, []
+        except FutureTimeout:
+            metrics.inc('argo_rag_shed_total', reason='timeout', help_text="RAG requests shed instead of served.")
+            logging.warning(f"RAG request timed out after {timeout}s waiting for an identical request.")
+            return BUSY_MESSAGE, []
+        finally:
+            metrics.add_gauge('argo_rag_in_flight', -1)
+
+    def _answer(self, question, priority, deadline):
+        context_data, message = self.rag.retrieve(question)
+        if message is not None:
+            return message, context_data
+
+        job = _GenerationJob(question, context_data, deadline)
+        try:
+            self._queue.put_nowait((priority, next(self._sequence), job))
+        except queue.Full:
+            metrics.inc('argo_rag_shed_total', reason='queue_full', help_text="RAG requests shed instead of served.")
+            raise ServiceBusy(f"generation queue is full ({self._queue.maxsize} waiting)")
+        metrics.add_queue_depth('generation', 1)
+
+        try:
+            return job.future.result(timeout=max(0.0, deadline - time.monotonic())), context_data
+        except FutureTimeout:
+            # A job that has not started yet is dropped; a running generation finishes but is discarded
+            job.future.cancel()
+            metrics.inc('argo_rag_shed_total', reason='timeout', help_text="RAG requests shed instead of served.")
+            raise ServiceBusy("no generation result before the deadline")
+
+    def _work(self):
+        while True:
+            _, _, job = self._queue.get()
+            metrics.add_queue_depth('generation', -1)
+            try:
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                metrics.observe(STAGE_HISTOGRAM, time.monotonic() - job.enqueued_at, stage='generation_queue_wait',
+                                help_text="Time spent per pipeline stage.")
+                if time.monotonic() >= job.deadline:
+                    metrics.inc('argo_rag_shed_total', reason='expired', help_text="RAG requests shed instead of served.")
+                    job.future.set_exception(ServiceBusy("request expired while queued"))
+                    continue
+                try:
+                    job.future.set_result(self.rag.generate(job.question, job.context_data))
+                except Exception as e:
+                    job.future.set_exception(e)
+            finally:
+                self._queue.task_done()
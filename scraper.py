@@ -3,6 +3,8 @@ import requests
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin
 
+from argo_files import resolve_preferred_files
+
 
 # Base URL for the Ifremer data server
 IFREMER_BASE_URL = "https://data-argo.ifremer.fr/dac/"
@@ -75,20 +77,26 @@ def fetch_and_upload_float_data(float_id: str):
         nc_files_to_upload = []
         
         # Filter for only the core NetCDF data files (R*.nc or D*.nc)
-        for link in links:
-            filename = link.get('href')
-            if (filename.startswith('R') or filename.startswith('D')) and filename.endswith('.nc'):
-                file_url = urljoin(profiles_url, filename)
-                
-                # Download the file content into memory
-                print(f"  Downloading {filename}...")
-                file_response = requests.get(file_url)
-                file_response.raise_for_status()
-                
-                # Prepare the file for multipart upload without saving it to disk first
-                nc_files_to_upload.append(
-                    ('files', (filename, file_response.content, 'application/x-netcdf'))
-                )
+        filenames = [link.get('href') for link in links]
+        filenames = [f for f in filenames if f and (f.startswith('R') or f.startswith('D')) and f.endswith('.nc')]
+
+        # Skip real-time files that a delayed-mode file for the same cycle supersedes
+        filenames, superseded = resolve_preferred_files(filenames)
+        if superseded:
+            print(f"  Skipping {len(superseded)} files superseded by delayed-mode or ascending profiles.")
+
+        for filename in filenames:
+            file_url = urljoin(profiles_url, filename)
+
+            # Download the file content into memory
+            print(f"  Downloading {filename}...")
+            file_response = requests.get(file_url)
+            file_response.raise_for_status()
+
+            # Prepare the file for multipart upload without saving it to disk first
+            nc_files_to_upload.append(
+                ('files', (filename, file_response.content, 'application/x-netcdf'))
+            )
 
         if not nc_files_to_upload:
             print(f"No NetCDF profile files (.nc) found for float {float_id}.")
@@ -0,0 +1,222 @@
+import math
+import logging
+import threading
+import itertools
+import numpy as np
+from sqlalchemy import inspect, text
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+
+
+def _to_epoch_seconds(value):
+    """Converts a datetime/date/string to float seconds since 1970-01-01 (naive UTC)."""
+    if value is None:
+        return None
+    return float(np.datetime64(value, 's').astype(np.int64))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km; all arguments in degrees, numpy-broadcastable."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class ProfileSpatialIndex:
+    """
+    In-memory lat/lon grid over profile positions and times.
+
+    Points are bucketed into fixed-size cells; a query only computes haversine
+    distances for the cells overlapping the search circle's bounding box.
+    """
+    def __init__(self, cell_degrees=2.0):
+        self.cell_degrees = float(cell_degrees)
+        self.n_lat_cells = int(math.ceil(180.0 / self.cell_degrees))
+        self.n_lon_cells = int(math.ceil(360.0 / self.cell_degrees))
+        self._lock = threading.RLock()
+        self._size = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._lat = np.empty(0, dtype=np.float64)
+        self._lon = np.empty(0, dtype=np.float64)
+        self._time = np.empty(0, dtype=np.float64)
+        self._cells = {}
+        self._row_of_id = {}
+        self._max_loaded_id = 0
+        self._updated_since = None
+        self._ids_at_updated_since = set()
+
+    def __len__(self):
+        return self._size
+
+    def _cell_of(self, lat, lon):
+        i = min(int((lat + 90.0) // self.cell_degrees), self.n_lat_cells - 1)
+        j = int(((lon + 180.0) % 360.0) // self.cell_degrees) % self.n_lon_cells
+        return i, j
+
+    def _grow(self, needed):
+        capacity = len(self._ids)
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2, 1024)
+        for name in ('_ids', '_lat', '_lon', '_time'):
+            old = getattr(self, name)
+            new = np.empty(new_capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    @staticmethod
+    def _updated_at_column(engine):
+        # Tables created before in-place updates were tracked have no updated_at column
+        columns = {c["name"] for c in inspect(engine).get_columns("argo_profiles")}
+        return "updated_at" if "updated_at" in columns else "NULL"
+
+    def load(self, engine):
+        """
+        Rebuilds the index from the argo_profiles table.
+        """
+        with engine.connect() as conn:
+            rows = conn.execute(text(
+                f"SELECT profile_id, latitude, longitude, profile_time, {self._updated_at_column(engine)} FROM argo_profiles"
+            )).fetchall()
+        with self._lock:
+            self._size = 0
+            self._cells = {}
+            self._row_of_id = {}
+            self._max_loaded_id = 0
+            self._updated_since = None
+            self._ids_at_updated_since = set()
+            self._grow(len(rows))
+            for profile_id, lat, lon, profile_time, updated_at in rows:
+                self._add_locked(profile_id, lat, lon, profile_time, updated_at)
+        logging.info(f"Spatial index loaded with {self._size} profiles.")
+
+    def refresh(self, engine):
+        """
+        Adds profiles inserted, and moves profiles updated in place, since the last load/refresh,
+        e.g. by an ingest running in another process. Returns the number of profiles added or moved.
+        """
+        with self._lock:
+            max_loaded, since = self._max_loaded_id, self._updated_since
+        updated_at = self._updated_at_column(engine)
+        query = f"SELECT profile_id, latitude, longitude, profile_time, {updated_at} FROM argo_profiles WHERE profile_id > :max_loaded"
+        params = {"max_loaded": max_loaded}
+        if since is not None and updated_at != "NULL":
+            # >= so rows written in the same second as the watermark are not missed; re-adding moves them in place
+            query += " OR updated_at >= :since"
+            params["since"] = since
+        with engine.connect() as conn:
+            rows = conn.execute(text(query), params).fetchall()
+        changed = 0
+        with self._lock:
+            self._grow(self._size + len(rows))
+            for profile_id, lat, lon, profile_time, row_updated_at in rows:
+                if row_updated_at == self._updated_since and profile_id in self._ids_at_updated_since:
+                    # Matched again only because of the >=; already indexed with this version
+                    continue
+                self._add_locked(profile_id, lat, lon, profile_time, row_updated_at)
+                changed += 1
+        if changed:
+            logging.info(f"Spatial index refreshed with {changed} new or updated profiles.")
+        return changed
+
+    def add(self, profile_id, lat, lon, profile_time):
+        """
+        Adds a profile, or moves it if the profile_id is already indexed.
+        """
+        with self._lock:
+            self._add_locked(profile_id, lat, lon, profile_time)
+
+    def _add_locked(self, profile_id, lat, lon, profile_time, updated_at=None):
+        lat, lon = float(lat), float(lon)
+        if updated_at is not None:
+            if self._updated_since is None or updated_at > self._updated_since:
+                self._updated_since = updated_at
+                self._ids_at_updated_since = {profile_id}
+            elif updated_at == self._updated_since:
+                self._ids_at_updated_since.add(profile_id)
+        row = self._row_of_id.get(profile_id)
+        if row is None:
+            self._grow(self._size + 1)
+            row = self._size
+            self._size += 1
+            self._row_of_id[profile_id] = row
+        else:
+            self._cells[self._cell_of(self._lat[row], self._lon[row])].remove(row)
+        self._ids[row] = profile_id
+        self._max_loaded_id = max(self._max_loaded_id, int(profile_id))
+        self._lat[row] = lat
+        self._lon[row] = lon
+        t = _to_epoch_seconds(profile_time)
+        self._time[row] = np.nan if t is None else t
+        self._cells.setdefault(self._cell_of(lat, lon), []).append(row)
+
+    def _candidate_rows(self, lat, lon, radius_km):
+        """Rows in the cells overlapping the bounding box of the search circle."""
+        if radius_km >= math.pi * EARTH_RADIUS_KM:
+            return np.arange(self._size)
+
+        dlat = radius_km / KM_PER_DEGREE
+        lat_lo, lat_hi = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+        i_lo, _ = self._cell_of(lat_lo, 0.0)
+        i_hi, _ = self._cell_of(lat_hi, 0.0)
+
+        angular = radius_km / EARTH_RADIUS_KM
+        cos_lat = math.cos(math.radians(lat))
+        if lat_lo <= -90.0 or lat_hi >= 90.0 or math.sin(angular) >= cos_lat:
+            lon_cells = range(self.n_lon_cells)
+        else:
+            dlon = math.degrees(math.asin(math.sin(angular) / cos_lat))
+            _, j_lo = self._cell_of(0.0, lon - dlon)
+            span = int(math.ceil(2 * dlon / self.cell_degrees)) + 1
+            if span + 1 >= self.n_lon_cells:
+                lon_cells = range(self.n_lon_cells)
+            else:
+                lon_cells = [(j_lo + s) % self.n_lon_cells for s in range(span + 1)]
+
+        cells = self._cells
+        return np.fromiter(
+            itertools.chain.from_iterable(cells.get((i, j), ()) for i in range(i_lo, i_hi + 1) for j in lon_cells),
+            dtype=np.int64,
+        )
+
+    def _query_locked(self, lat, lon, radius_km, start_time, end_time):
+        rows = self._candidate_rows(lat, lon, radius_km)
+        if start_time is not None or end_time is not None:
+            times = self._time[rows]
+            mask = np.ones(len(rows), dtype=bool)
+            if start_time is not None:
+                mask &= times >= _to_epoch_seconds(start_time)
+            if end_time is not None:
+                mask &= times <= _to_epoch_seconds(end_time)
+            rows = rows[mask]
+        dist = haversine_km(lat, lon, self._lat[rows], self._lon[rows])
+        keep = dist <= radius_km
+        rows, dist = rows[keep], dist[keep]
+        order = np.argsort(dist, kind='stable')
+        return self._ids[rows[order]], dist[order]
+
+    def within(self, lat, lon, radius_km, start_time=None, end_time=None, return_distance=False):
+        """
+        Profiles within radius_km of (lat, lon), optionally inside a time window, nearest first.
+        """
+        with self._lock:
+            ids, dist = self._query_locked(lat, lon, radius_km, start_time, end_time)
+        ids = ids.tolist()
+        return (ids, dist.tolist()) if return_distance else ids
+
+    def nearest(self, lat, lon, k=5, start_time=None, end_time=None, return_distance=False):
+        """
+        The k profiles nearest to (lat, lon), optionally inside a time window.
+        The search radius doubles until at least k profiles fall inside it.
+        """
+        radius_km = self.cell_degrees * KM_PER_DEGREE
+        max_radius = math.pi * EARTH_RADIUS_KM
+        with self._lock:
+            while True:
+                ids, dist = self._query_locked(lat, lon, radius_km, start_time, end_time)
+                if len(ids) >= k or radius_km >= max_radius:
+                    break
+                radius_km = min(radius_km * 2.0, max_radius)
+        ids = ids[:k].tolist()
+        return (ids, dist[:k].tolist()) if return_distance else ids
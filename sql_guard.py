@@ -0,0 +1,194 @@
+import re
+import logging
+from decimal import Decimal
+import mysql.connector
+
+from config import (DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME, DB_REPLICA_HOST, DB_REPLICA_PORT,
+                    SQL_GUARD_MAX_ROWS, SQL_GUARD_MAX_EXECUTION_MS, SQL_GUARD_REPLICA_ROWS,
+                    SQL_GUARD_MAX_ESTIMATED_ROWS, SQL_GUARD_TABLE_FUNCTION_ROWS)
+from metrics import metrics
+
+# String literals and quoted identifiers (kept as they are) and comments (dropped)
+LITERAL_OR_COMMENT = re.compile(
+    r"""('(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|`[^`]*`)|(/\*.*?\*/|--(?=\s|$)[^\n]*|#[^\n]*)""", re.S
+)
+READ_STATEMENT = re.compile(r"^\(*\s*(SELECT|WITH)\b", re.IGNORECASE)
+# Writes, locking reads, file/variable output and server-side stalls; matched outside literals only
+FORBIDDEN = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|DROP|ALTER|CREATE|TRUNCATE|RENAME|GRANT|REVOKE|CALL|HANDLER|LOAD|LOCK|INTO|"
+    r"SLEEP|BENCHMARK|GET_LOCK|LOAD_FILE)\b|\bFOR\s+SHARE\b",
+    re.IGNORECASE,
+)
+TRAILING_LIMIT = re.compile(r"\bLIMIT\s+(\d+)\s*(?:,\s*(\d+)|OFFSET\s+\d+)?\s*$", re.IGNORECASE)
+
+# EXPLAIN select_types whose block is re-run for every row of its outer query
+CORRELATED_SELECT_TYPES = ('DEPENDENT SUBQUERY', 'UNCACHEABLE SUBQUERY', 'DEPENDENT UNION', 'UNCACHEABLE UNION')
+
+# ER_QUERY_TIMEOUT: the statement was stopped by max_execution_time
+QUERY_TIMEOUT_ERRNO = 3024
+
+
+class QueryRejected(Exception):
+    """Raised when a query is not allowed to run; the message is meant to be shown to the LLM that wrote it."""
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+def connection_settings(host=DB_HOST, port=DB_PORT):
+    """Keyword arguments for mysql.connector.connect built from config.py."""
+    return {"host": host, "port": int(port), "user": DB_USER, "password": DB_PASSWORD, "database": DB_NAME}
+
+
+def validate_select(query: str):
+    """
+    Checks that query is a single read-only SELECT (or WITH ... SELECT) statement.
+    Returns it without comments and the trailing semicolon; raises QueryRejected otherwise.
+    """
+    def strip_comment(match):
+        comment = match.group(2)
+        if comment is None:
+            return match.group(1)
+        if comment.startswith(('/*!', '/*+')):
+            # MySQL executes the contents of /*! ... */ comments, and hints are added by the guard itself
+            raise QueryRejected('not_select', "Comments with MySQL-specific code or optimizer hints are not allowed.")
+        return ' '
+    sql = LITERAL_OR_COMMENT.sub(strip_comment, query).strip().rstrip(';').strip()
+    masked = LITERAL_OR_COMMENT.sub("''", sql)
+
+    if not sql:
+        raise QueryRejected('not_select', "The query is empty.")
+    if ';' in masked:
+        raise QueryRejected('not_select', "Only a single SQL statement is allowed.")
+    if not READ_STATEMENT.match(masked):
+        raise QueryRejected('not_select', "Only SELECT statements are allowed.")
+    forbidden = FORBIDDEN.search(masked)
+    if forbidden:
+        raise QueryRejected('not_select', f"'{forbidden.group(0).upper()}' is not allowed; only plain SELECT statements can run.")
+    return sql
+
+
+def apply_row_limit(sql: str, max_rows: int):
+    """Appends LIMIT max_rows, or lowers a trailing LIMIT that asks for more rows than that."""
+    match = TRAILING_LIMIT.search(sql)
+    if not match:
+        return f"{sql}\nLIMIT {max_rows}"
+    count_group = 2 if match.group(2) else 1
+    if int(match.group(count_group)) <= max_rows:
+        return sql
+    return sql[:match.start(count_group)] + str(max_rows) + sql[match.end(count_group):]
+
+
+def estimate_examined_rows(plan, table_function_rows=SQL_GUARD_TABLE_FUNCTION_ROWS):
+    """
+    Rough number of rows a query examines, from the rows column of a tabular EXPLAIN.
+    Tables of one SELECT block are joined in nested loops, so their estimates multiply; blocks add up,
+    except correlated subqueries, which run once per row of the block before them and multiply with it.
+    MySQL cannot estimate table functions and reports JSON_TABLE as ~2 rows, so those count as table_function_rows.
+    """
+    blocks = {}
+    correlated = set()
+    for step in plan:
+        select_id = step.get('id')
+        if step.get('select_type') in CORRELATED_SELECT_TYPES:
+            correlated.add(select_id)
+        rows = step.get('rows')
+        if 'Table function' in (step.get('Extra') or ''):
+            rows = max(int(rows or 0), table_function_rows)
+        if rows is None:
+            continue
+        blocks[select_id] = blocks.get(select_id, 1) * max(int(rows), 1)
+
+    # The tabular plan does not say which block a subquery is correlated with; the preceding block is
+    # its outer query or a sibling, so this overestimates rather than lets a nested loop through
+    total, previous = 0, None
+    for select_id in sorted(blocks, key=lambda i: (i is None, i or 0)):
+        rows = blocks[select_id]
+        if select_id in correlated and previous is not None:
+            rows *= previous
+        total += rows
+        previous = rows
+    return total
+
+
+class GuardedQueryRunner:
+    """
+    Runs LLM-generated SQL so it cannot write, lock or overload the database ingestion depends on.
+    Queries are validated, capped with LIMIT and max_execution_time, and costed with EXPLAIN first:
+    heavy ones go to the read replica, and queries too heavy for that (or heavy without a replica) are refused.
+    """
+    def __init__(self, primary=None, replica=None, max_rows=SQL_GUARD_MAX_ROWS,
+                 max_execution_ms=SQL_GUARD_MAX_EXECUTION_MS, replica_rows=SQL_GUARD_REPLICA_ROWS,
+                 max_estimated_rows=SQL_GUARD_MAX_ESTIMATED_ROWS):
+        self.primary = primary or connection_settings()
+        if replica is None and DB_REPLICA_HOST:
+            replica = connection_settings(DB_REPLICA_HOST, DB_REPLICA_PORT)
+        self.replica = replica
+        self.max_rows = max_rows
+        self.max_execution_ms = max_execution_ms
+        self.replica_rows = replica_rows
+        self.max_estimated_rows = max_estimated_rows
+
+    def run(self, query: str):
+        """
+        Returns {"query", "results", "estimated_rows", "server"}; raises QueryRejected when the query may not run.
+        """
+        try:
+            sql = apply_row_limit(validate_select(query), self.max_rows)
+            estimate = self._estimate(sql)
+            server = self._route(estimate)
+            with metrics.timer('guarded_sql', server=server):
+                results = self._execute(self.replica if server == 'replica' else self.primary, sql)
+        except QueryRejected as e:
+            metrics.inc('argo_sql_guard_rejected_total', reason=e.reason, help_text="LLM-generated SQL queries refused by the guard.")
+            logging.warning(f"Rejected generated SQL ({e.reason}): {e}")
+            raise
+        metrics.inc('argo_sql_guard_queries_total', server=server, help_text="LLM-generated SQL queries run by the guard.")
+        return {"query": sql, "results": results, "estimated_rows": estimate, "server": server}
+
+    def _route(self, estimate):
+        if estimate > self.max_estimated_rows:
+            raise QueryRejected('too_expensive', f"The query would examine about {estimate:,} rows "
+                                                 f"(limit {self.max_estimated_rows:,}). Filter on indexed columns or aggregate less data.")
+        if estimate <= self.replica_rows:
+            return 'primary'
+        if self.replica is None:
+            raise QueryRejected('too_expensive', f"The query would examine about {estimate:,} rows, more than the "
+                                                 f"{self.replica_rows:,} allowed on the primary database, and no read replica is configured.")
+        return 'replica'
+
+    def _estimate(self, sql):
+        conn = mysql.connector.connect(**(self.replica or self.primary))
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(f"EXPLAIN {sql}")
+            return estimate_examined_rows(cursor.fetchall())
+        except mysql.connector.Error as e:
+            raise QueryRejected('invalid', f"MySQL could not plan the query: {e.msg}")
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _execute(self, settings, sql):
+        conn = mysql.connector.connect(**settings)
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(f"SET SESSION max_execution_time = {int(self.max_execution_ms)}")
+            cursor.execute("START TRANSACTION READ ONLY")
+            cursor.execute(sql)
+            results = cursor.fetchall()
+            conn.rollback()
+
+            # Convert Decimal → float
+            for row in results:
+                for k, v in row.items():
+                    if isinstance(v, Decimal):
+                        row[k] = float(v)
+            return results
+        except mysql.connector.Error as e:
+            if e.errno == QUERY_TIMEOUT_ERRNO:
+                raise QueryRejected('timeout', f"The query was stopped after {self.max_execution_ms} ms. Write a cheaper query.")
+            raise
+        finally:
+            cursor.close()
+            conn.close()
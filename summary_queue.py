@@ -0,0 +1,319 @@
+import os
+import uuid
+import time
+import random
+import socket
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import text
+
+from config import (SUMMARY_WORKERS, SUMMARY_BATCH_SIZE, SUMMARY_MAX_ATTEMPTS, SUMMARY_LEASE_SECONDS,
+                    SUMMARY_BACKOFF_SECONDS, SUMMARY_BACKOFF_MAX_SECONDS, SUMMARY_POLL_SECONDS,
+                    SUMMARY_METRICS_PORT, METRICS_LOG_SECONDS)
+from metrics import metrics, start_metrics_server, log_summary_periodically
+
+PENDING, LEASED, DONE, FAILED = 'pending', 'leased', 'done', 'failed'
+
+
+class SummaryQueue:
+    """
+    Durable queue of profiles waiting to be summarized and embedded into ChromaDB.
+
+    Rows live in the summary_queue table next to argo_profiles. Workers lease rows for a
+    limited time, so a crashed worker's rows become claimable again once the lease expires.
+    """
+    def __init__(self, engine, max_attempts=SUMMARY_MAX_ATTEMPTS, lease_seconds=SUMMARY_LEASE_SECONDS,
+                 backoff_seconds=SUMMARY_BACKOFF_SECONDS, backoff_max_seconds=SUMMARY_BACKOFF_MAX_SECONDS):
+        self.engine = engine
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+
+    def create_table(self, conn):
+        """
+        Creates the summary_queue table on an open connection (committed by the caller).
+        """
+        is_sqlite = self.engine.dialect.name == 'sqlite'
+        conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS summary_queue (
+            profile_id INT PRIMARY KEY,
+            status VARCHAR(16) NOT NULL,
+            attempts INT NOT NULL DEFAULT 0,
+            available_at DATETIME NOT NULL,
+            lease_owner VARCHAR(64),
+            lease_until DATETIME,
+            last_error TEXT,
+            updated_at DATETIME NOT NULL,
+            FOREIGN KEY (profile_id) REFERENCES argo_profiles(profile_id){'' if is_sqlite else ','}
+            {'' if is_sqlite else 'KEY idx_summary_queue_status (status, available_at)'}
+        );
+        """))
+        if is_sqlite:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_summary_queue_status ON summary_queue (status, available_at)"))
+
+    def enqueue(self, profile_ids, conn=None):
+        """
+        Queues profiles for (re)summarization. Already queued profiles are reset to pending with fresh attempts.
+        """
+        profile_ids = list(profile_ids)
+        if not profile_ids:
+            return
+        now = datetime.utcnow()
+        if self.engine.dialect.name == 'sqlite':
+            upsert = """
+                INSERT INTO summary_queue (profile_id, status, attempts, available_at, updated_at)
+                VALUES (:profile_id, 'pending', 0, :now, :now)
+                ON CONFLICT(profile_id) DO UPDATE SET status = 'pending', attempts = 0, available_at = :now,
+                    lease_owner = NULL, lease_until = NULL, last_error = NULL, updated_at = :now
+            """
+        else:
+            upsert = """
+                INSERT INTO summary_queue (profile_id, status, attempts, available_at, updated_at)
+                VALUES (:profile_id, 'pending', 0, :now, :now)
+                ON DUPLICATE KEY UPDATE status = 'pending', attempts = 0, available_at = :now,
+                    lease_owner = NULL, lease_until = NULL, last_error = NULL, updated_at = :now
+            """
+        params = [{"profile_id": pid, "now": now} for pid in profile_ids]
+        if conn is not None:
+            conn.execute(text(upsert), params)
+            return
+        with self.engine.connect() as own_conn:
+            own_conn.execute(text(upsert), params)
+            own_conn.commit()
+
+    def claim(self, worker_id, limit=SUMMARY_BATCH_SIZE):
+        """
+        Leases up to `limit` due rows for a worker and returns their profile ids.
+        Each row is taken with a conditional UPDATE, so concurrent workers never claim the same row.
+        """
+        now = datetime.utcnow()
+        claimable = """
+            ((status = 'pending' AND available_at <= :now) OR (status = 'leased' AND lease_until < :now))
+        """
+        claimed = []
+        with self.engine.connect() as conn:
+            candidates = [row[0] for row in conn.execute(text(f"""
+                SELECT profile_id FROM summary_queue WHERE {claimable}
+                ORDER BY available_at LIMIT :limit
+            """), {"now": now, "limit": limit})]
+            for profile_id in candidates:
+                result = conn.execute(text(f"""
+                    UPDATE summary_queue
+                    SET status = 'leased', lease_owner = :worker, lease_until = :lease_until,
+                        attempts = attempts + 1, updated_at = :now
+                    WHERE profile_id = :profile_id AND {claimable}
+                """), {"worker": worker_id, "lease_until": now + timedelta(seconds=self.lease_seconds),
+                       "now": now, "profile_id": profile_id})
+                if result.rowcount == 1:
+                    claimed.append(profile_id)
+            conn.commit()
+        return claimed
+
+    def renew(self, profile_id, worker_id):
+        """
+        Extends a worker's lease on a row to a full lease from now, before it starts on that row.
+        Returns False if the lease expired and another worker took the row over.
+        """
+        now = datetime.utcnow()
+        with self.engine.connect() as conn:
+            result = conn.execute(text("""
+                UPDATE summary_queue SET lease_until = :lease_until, updated_at = :now
+                WHERE profile_id = :profile_id AND lease_owner = :worker AND status = 'leased'
+            """), {"lease_until": now + timedelta(seconds=self.lease_seconds), "now": now,
+                   "profile_id": profile_id, "worker": worker_id})
+            conn.commit()
+        return result.rowcount == 1
+
+    def complete(self, profile_id, worker_id):
+        with self.engine.connect() as conn:
+            conn.execute(text("""
+                UPDATE summary_queue SET status = 'done', lease_owner = NULL, lease_until = NULL,
+                    last_error = NULL, updated_at = :now
+                WHERE profile_id = :profile_id AND lease_owner = :worker
+            """), {"profile_id": profile_id, "worker": worker_id, "now": datetime.utcnow()})
+            conn.commit()
+
+    def fail(self, profile_id, worker_id, error):
+        """
+        Returns a leased row to the queue with exponential backoff, or marks it failed after max_attempts.
+        """
+        now = datetime.utcnow()
+        with self.engine.connect() as conn:
+            attempts = conn.execute(text("SELECT attempts FROM summary_queue WHERE profile_id = :profile_id"),
+                                    {"profile_id": profile_id}).scalar() or 0
+            if attempts >= self.max_attempts:
+                status, available_at = FAILED, now
+            else:
+                delay = min(self.backoff_seconds * 2 ** max(attempts - 1, 0), self.backoff_max_seconds)
+                status, available_at = PENDING, now + timedelta(seconds=delay * random.uniform(0.8, 1.2))
+            conn.execute(text("""
+                UPDATE summary_queue SET status = :status, available_at = :available_at, lease_owner = NULL,
+                    lease_until = NULL, last_error = :error, updated_at = :now
+                WHERE profile_id = :profile_id AND lease_owner = :worker
+            """), {"status": status, "available_at": available_at, "error": str(error)[:2000], "now": now,
+                   "profile_id": profile_id, "worker": worker_id})
+            conn.commit()
+        return status
+
+    def counts(self):
+        """Returns the number of rows per status."""
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("SELECT status, COUNT(*) FROM summary_queue GROUP BY status")).fetchall()
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        counts.update({status: count for status, count in rows})
+        for status in (PENDING, LEASED, FAILED):
+            metrics.set_queue_depth(f'summary_{status}', counts[status])
+        return counts
+
+
+class SummaryWorker:
+    """
+    Drains the summary queue: loads each profile from MySQL, summarizes it with the LLM and upserts it into ChromaDB.
+    """
+    def __init__(self, db_manager, queue: SummaryQueue, worker_id=None, batch_size=SUMMARY_BATCH_SIZE,
+                 poll_seconds=SUMMARY_POLL_SECONDS):
+        self.db_manager = db_manager
+        self.queue = queue
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+
+    def run(self, stop_event=None, drain=False):
+        """
+        Processes leased batches until stopped. With drain=True, returns as soon as nothing is due.
+        """
+        processed = 0
+        while stop_event is None or not stop_event.is_set():
+            profile_ids = self.queue.claim(self.worker_id, self.batch_size)
+            if not profile_ids:
+                if drain:
+                    break
+                time.sleep(self.poll_seconds)
+                continue
+            self.db_manager.follow_active_collection()
+            for profile_id in profile_ids:
+                # The batch shares one lease expiry, but each profile can take up to the summary request timeout
+                if not self.queue.renew(profile_id, self.worker_id):
+                    metrics.inc('argo_summary_leases_lost_total', help_text="Claimed rows taken over by another worker before processing.")
+                    logging.warning(f"Lease on profile {profile_id} expired before it was processed; leaving it to its new owner.")
+                    continue
+                processed += self._process(profile_id)
+            self.queue.counts()
+        return processed
+
+    def _process(self, profile_id):
+        try:
+            with metrics.timer('summary_task'):
+                profile = self.db_manager.get_profile(profile_id)
+                if profile is None:
+                    raise LookupError(f"profile {profile_id} no longer exists in MySQL")
+                self.db_manager.add_profile_to_chromadb(
+                    profile_id, str(profile["wmo_number"]), profile["cycle_number"], profile["profile_time"],
+                    profile["latitude"], profile["longitude"], (profile["bgc_params"] or {}).keys(),
+                    profile["pressure"], profile["temperature"], profile["salinity"]
+                )
+            self.queue.complete(profile_id, self.worker_id)
+            metrics.inc('argo_summaries_completed_total', help_text="Profiles summarized and embedded.")
+            return 1
+        except Exception as e:
+            status = self.queue.fail(profile_id, self.worker_id, e)
+            metrics.inc('argo_summaries_failed_total', status=status, help_text="Summary attempts that failed.")
+            logging.warning(f"Summarizing profile {profile_id} failed ({status}): {e}")
+            return 0
+
+
+def reconcile(db_manager, queue: SummaryQueue, page_size=5000, retry_failed=False):
+    """
+    Enqueues MySQL profiles that have no ChromaDB entry and are not already pending or leased.
+    Profiles that used up their attempts stay failed unless retry_failed is set, so
+    SUMMARY_MAX_ATTEMPTS still ends a retry loop when reconcile runs on every ingest.
+    Returns the number of profiles enqueued.
+    """
+    skipped_statuses = (PENDING, LEASED) if retry_failed else (PENDING, LEASED, FAILED)
+    with db_manager.mysql_engine.connect() as conn:
+        mysql_ids = {row[0] for row in conn.execute(text("SELECT profile_id FROM argo_profiles"))}
+        in_flight = {row[0] for row in conn.execute(
+            text(f"SELECT profile_id FROM summary_queue WHERE status IN ({', '.join(repr(s) for s in skipped_statuses)})")
+        )}
+
+    chroma_ids = set()
+    offset = 0
+    while True:
+        page = db_manager.chroma_collection.get(include=[], limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        chroma_ids.update(int(i.split('_', 1)[1]) for i in page['ids'] if i.startswith('profile_'))
+        offset += len(page['ids'])
+
+    missing = sorted(mysql_ids - chroma_ids - in_flight)
+    for i in range(0, len(missing), page_size):
+        queue.enqueue(missing[i:i + page_size])
+    logging.info(f"Reconciler: {len(mysql_ids)} profiles in MySQL, {len(chroma_ids)} in ChromaDB, "
+                 f"{len(missing)} enqueued for summarization.")
+    return len(missing)
+
+
+def run_workers(db_manager, queue: SummaryQueue, workers=SUMMARY_WORKERS, drain=False, stop_event=None):
+    """
+    Runs several SummaryWorkers in threads sharing one DatabaseManager; returns the number of profiles processed.
+    """
+    stop_event = stop_event or threading.Event()
+    results = [0] * workers
+
+    def target(n):
+        results[n] = SummaryWorker(db_manager, queue).run(stop_event=stop_event, drain=drain)
+
+    threads = [threading.Thread(target=target, args=(n,), name=f"summary-worker-{n}", daemon=True)
+               for n in range(workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=1.0)
+    except KeyboardInterrupt:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+    return sum(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize-and-embed workers for the ARGO summary queue.")
+    parser.add_argument('command', choices=['work', 'drain', 'reconcile', 'status'],
+                        help="'work' runs until interrupted, 'drain' stops when the queue is empty")
+    parser.add_argument('--workers', type=int, default=SUMMARY_WORKERS)
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="with 'reconcile', also re-enqueue profiles that exhausted their attempts")
+    parser.add_argument('--metrics-port', type=int, default=SUMMARY_METRICS_PORT,
+                        help="serve Prometheus metrics on this port while working (0 disables)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from database_manager import DatabaseManager
+    db_manager = DatabaseManager()
+    db_manager.create_mysql_tables()
+    queue = db_manager.summary_queue
+
+    if args.command == 'reconcile':
+        reconcile(db_manager, queue, retry_failed=args.retry_failed)
+    elif args.command in ('work', 'drain'):
+        if args.metrics_port:
+            start_metrics_server(args.metrics_port)
+        stop_logging = threading.Event()
+        log_summary_periodically(METRICS_LOG_SECONDS, stop_logging)
+        try:
+            processed = run_workers(db_manager, queue, workers=args.workers, drain=args.command == 'drain')
+        finally:
+            stop_logging.set()
+        logging.info(f"Summary workers processed {processed} profiles.")
+        metrics.log_summary()
+    logging.info(f"Summary queue: {queue.counts()}")
+
+
+if __name__ == "__main__":
+    main()
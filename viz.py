@@ -3,14 +3,16 @@ import chromadb
 import ollama
 import json
 from decimal import Decimal
+from datetime import datetime
+from chroma_reindex import active_collection_name
+from sql_guard import GuardedQueryRunner, QueryRejected, connection_settings
  
 # --- MySQL connection ---
 def run_mysql_query(query):
-    conn = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="shyam123",
-            database="argo_ocean_data")
+    """
+    Runs a trusted, internally built query. SQL written by the LLM goes through run_guarded_query instead.
+    """
+    conn = mysql.connector.connect(**connection_settings())
     cursor = conn.cursor(dictionary=True)
 
     try:
@@ -30,9 +32,20 @@ def run_mysql_query(query):
         cursor.close()
         conn.close()
 
+# --- Guarded execution of LLM-generated SQL ---
+sql_runner = GuardedQueryRunner()
+
+def run_guarded_query(query):
+    try:
+        return sql_runner.run(query)
+    except QueryRejected as e:
+        return {"error": f"Query rejected: {e}", "rejected": str(e), "query": query}
+    except Exception as e:
+        return {"error": str(e), "query": query}
+
 # --- ChromaDB connection ---
 client = chromadb.PersistentClient(path="./chroma_db_storage")
-collection = client.get_collection("argo_float_profiles")
+collection = client.get_collection(active_collection_name("./chroma_db_storage"))
 
 def query_chromadb(user_query):
     try:
@@ -44,14 +57,65 @@ def query_chromadb(user_query):
     except Exception as e:
         return {"query": user_query, "error": str(e)}
 
+# --- Spatial index (via DatabaseManager, created on first use) ---
+_db_manager = None
+
+def _get_db_manager():
+    global _db_manager
+    if _db_manager is None:
+        from database_manager import DatabaseManager
+        _db_manager = DatabaseManager()
+    return _db_manager
+
+def _parse_date_param(value, end_of_day=False):
+    """
+    Parses a YYYY-MM-DD (or ISO datetime) string from the LLM; a date-only end bound covers its whole day.
+    """
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(str(value))
+    if end_of_day and len(str(value)) == 10:
+        parsed = datetime.combine(parsed.date(), datetime.max.time())
+    return parsed
+
+def query_spatial(params):
+    """
+    Looks up profiles by position using the in-memory spatial index, then fetches their rows from MySQL.
+    """
+    db_manager = _get_db_manager()
+    lat, lon = float(params["latitude"]), float(params["longitude"])
+    start, end = _parse_date_param(params.get("start_date")), _parse_date_param(params.get("end_date"), end_of_day=True)
+    if params.get("radius_km"):
+        ids = db_manager.find_profiles_within(lat, lon, float(params["radius_km"]), start_time=start, end_time=end)
+    else:
+        ids = db_manager.find_nearest_profiles(lat, lon, k=int(params.get("k", 10)), start_time=start, end_time=end)
+    if not ids:
+        return {"query": params, "results": []}
+    id_list = ", ".join(str(int(i)) for i in ids)
+    return run_mysql_query(
+        "SELECT p.profile_id, f.wmo_number, p.cycle_number, p.profile_time, p.latitude, p.longitude "
+        "FROM argo_profiles p JOIN argo_floats f ON p.float_id = f.float_id "
+        f"WHERE p.profile_id IN ({id_list}) ORDER BY FIELD(p.profile_id, {id_list})"
+    )
+
 # --- Use Ollama (Gemma2 LLM) to decide ---
 import ollama
 import json
 
-def ask_llm(user_prompt: str) -> str:
+def ask_llm(user_prompt: str, rejected=None) -> str:
     """
     Asks a local LLM to decide which data source to use and generates the appropriate query.
+    rejected is an optional (query, reason) pair for a previous SQL attempt the guard refused.
     """
+    retry_note = ""
+    if rejected:
+        retry_note = f"""
+## Previous Attempt
+Your previous SQL query was refused by the database guard and did not run.
+- Query: {rejected[0]}
+- Reason: {rejected[1]}
+Write a cheaper, read-only query (filter on the indexed `profile_id` or `float_id` columns, avoid JSON_TABLE over all profiles and unbounded joins), or pick another data source.
+"""
     # Note: ollama.chat is a simplified way to call the model. 
     # For more complex streaming or error handling, a library like 'requests' can be used.
     response = ollama.chat(
@@ -61,6 +125,8 @@ You are an expert data assistant for an oceanographic database. Your job is to c
 
 ## Available Data Sources:
 
+0.  **Spatial index**: Use it for questions about profiles near a geographic position (e.g. "profiles near 10°N 75°E in March 2023"). It returns the nearest profiles, or those within a radius, optionally inside a date window.
+
 1.  **MySQL Database**: This database stores structured, raw sensor data from Argo floats. Use it for questions that require precise numerical lookups, aggregations, or filtering based on specific values like ID, location, or time.
     - **`argo_floats` table**: Contains metadata about each float (`float_id`, `wmo_number`, `project_name`).
     - **`argo_profiles` table**: Contains detailed measurements for each profile (`profile_id`, `float_id`, `cycle_number`, `profile_time`, `latitude`, `longitude`). The columns `pressure`, `temperature`, and `salinity` are stored as JSON arrays.
@@ -73,12 +139,15 @@ Based on the user's question below, you MUST output ONLY a single JSON object wi
 -   **For MySQL**, the format is:
     `{{"db": "mysql", "query": "A valid SQL query string that is safe to execute."}}`
 
+-   **For the spatial index**, the format is (latitude/longitude in decimal degrees, south/west negative; radius_km, k, start_date and end_date in YYYY-MM-DD are optional):
+    `{{"db": "spatial", "latitude": 10.0, "longitude": 75.0, "radius_km": 200, "k": 10, "start_date": "2023-03-01", "end_date": "2023-03-31"}}`
+
 -   **For ChromaDB**, the format is:
     `{{"db": "chromadb", "query": "A simple search text string that captures the user's intent."}}`
 
 ## User Question:
 {user_prompt}
-"""}]
+{retry_note}"""}]
     )
     
     # Extract and return the string content from the LLM's message
@@ -88,27 +157,36 @@ Based on the user's question below, you MUST output ONLY a single JSON object wi
 import re
 
 def process(user_prompt):
-    llm_output = ask_llm(user_prompt)
-
-    # --- Sanitize LLM output ---
-    cleaned = llm_output.strip()
-
-    # Remove ```json or ``` fences
-    if cleaned.startswith("```"):
-        cleaned = re.sub(r"```[a-zA-Z]*", "", cleaned)  # remove ```json or ```
-        cleaned = cleaned.replace("```", "").strip()
-
-    try:
-        parsed = json.loads(cleaned)
-    except Exception as e:
-        return {"error": f"LLM did not return valid JSON: {e}", "raw": llm_output}
-
-    if parsed["db"] == "mysql":
-        return run_mysql_query(parsed["query"])
-    elif parsed["db"] == "chromadb":
-        return query_chromadb(parsed["query"])
-    else:
-        return {"error": "Unknown DB target", "raw": parsed}
+    rejected = None
+    # A query refused by the SQL guard is sent back to the LLM once, with the reason
+    for attempt in range(2):
+        llm_output = ask_llm(user_prompt, rejected)
+
+        # --- Sanitize LLM output ---
+        cleaned = llm_output.strip()
+
+        # Remove ```json or ``` fences
+        if cleaned.startswith("```"):
+            cleaned = re.sub(r"```[a-zA-Z]*", "", cleaned)  # remove ```json or ```
+            cleaned = cleaned.replace("```", "").strip()
+
+        try:
+            parsed = json.loads(cleaned)
+        except Exception as e:
+            return {"error": f"LLM did not return valid JSON: {e}", "raw": llm_output}
+
+        if parsed["db"] == "mysql":
+            result = run_guarded_query(parsed["query"])
+            if "rejected" in result and attempt == 0:
+                rejected = (parsed["query"], result["rejected"])
+                continue
+            return result
+        elif parsed["db"] == "chromadb":
+            return query_chromadb(parsed["query"])
+        elif parsed["db"] == "spatial":
+            return query_spatial(parsed)
+        else:
+            return {"error": "Unknown DB target", "raw": parsed}
 
 
 # --- Test queries ---